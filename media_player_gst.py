@@ -32,6 +32,16 @@ __license__ = "GPLv3"
 import os, sys
 import thread				# To run the gst event loop with
 import time
+import threading, collections	# For reading ahead of playback
+import mmap
+import json
+import ctypes
+import multiprocessing, tempfile	# For decoding in a separate process
+import multiprocessing.pool
+import argparse, tarfile, shutil	# For the command line video checker
+import hashlib				# To identify videos in the transcoding cache
+import bisect				# To look up cues by frame number
+from timeit import default_timer	# The most precise timer on each platform
 import urlparse, urllib		# To build the URI that gst requires
 import numpy as np			# Only to easily create a black texture to start with
 
@@ -103,6 +113,599 @@ import pygame
 import psychopy
 
 
+# The maximum time prepare() waits for the read-ahead buffer to fill (in seconds)
+BUFFER_PREFILL_TIMEOUT = 30
+
+# The maximum time to wait for the decoder process to reply to a command (in seconds)
+DECODER_REPLY_TIMEOUT = 10
+
+# Above this playback rate (in either direction), only key frames are decoded
+TRICK_MODE_RATE = 2.0
+
+
+#---------------------------------------------------------------------
+# Helper functions
+#---------------------------------------------------------------------
+
+def file_uri(path):
+	"""
+	Converts a (relative) file path to the URI that gst requires
+
+	Arguments:
+	path -- the path to the file
+
+	Returns:
+	A file: URI pointing to the absolute location of the file
+	"""
+	path = os.path.abspath(path)
+	return urlparse.urljoin('file:', urllib.pathname2url(path))
+
+def video_caps(size=None):
+	"""
+	Creates the caps string that tells gst in which format decoded frames should be delivered
+
+	Keyword arguments:
+	size -- (width, height) tuple to which frames should be scaled by gst.
+		Frames are delivered at their original size if None (default)
+
+	Returns:
+	The caps string
+	"""
+	# Info required for color space conversion (YUV->RGB)
+	# masks are necessary for correct display on unix systems
+	caps = [
+	    'video/x-raw-rgb',
+	    'red_mask=(int)0xff0000',
+	    'green_mask=(int)0x00ff00',
+	    'blue_mask=(int)0x0000ff',
+	]
+	if not size is None:
+		caps += ['width=(int)%d' % size[0], 'height=(int)%d' % size[1]]
+	return ','.join(caps)
+
+def make_audio_sink(name, buffer_time = 0, latency_time = 0, location = None):
+	"""
+	Creates the audio sink to which the player outputs sound
+
+	Arguments:
+	name -- the gst element name of the sink (e.g. autoaudiosink or alsasink), "fakesink"
+		to discard the sound or "wav file" to write it to a file
+
+	Keyword arguments:
+	buffer_time -- the size of the sink's audio buffer in ms (default = 0, the sink's default)
+	latency_time -- the duration of a segment of the sink's audio buffer in ms,
+		i.e. the minimum latency (default = 0, the sink's default)
+	location -- the path to write the sound to for "wav file" (default = None)
+
+	Returns:
+	The sink element
+	"""
+	if name == u"wav file":
+		sink = gst.parse_bin_from_description("audioconvert ! wavenc ! filesink name=filesink", True)
+		filesink = sink.get_by_name("filesink")
+		filesink.set_property("location", location)
+		# Write the sound at the pace it would be played at, as a sound card would
+		filesink.set_property("sync", True)
+		return sink
+
+	try:
+		sink = gst.element_factory_make(str(name), "audiosink")
+	except gst.ElementNotFoundError:
+		raise osexception(u"The audio sink '%s' is not available. Check its name and whether the GStreamer plugin that provides it is installed." % name)
+	if name == u"fakesink":
+		sink.set_property("sync", True)
+		return sink
+
+	def configure(element):
+		if buffer_time > 0 and hasattr(element.props, "buffer_time"):
+			element.set_property("buffer-time", int(buffer_time * 1000))
+		if latency_time > 0 and hasattr(element.props, "latency_time"):
+			element.set_property("latency-time", int(latency_time * 1000))
+	configure(sink)
+	# autoaudiosink only creates the actual sink once it starts
+	if isinstance(sink, gst.Bin):
+		sink.connect("element-added", lambda bin, element: configure(element))
+	return sink
+
+def fit_resolution(screen_res, image_res):
+	"""
+	Calculates the size of an image scaled to fit the screen, maintaining its aspect ratio
+
+	Arguments:
+	screen_res -- (width, height) tuple of the display window or screen
+	image_res -- (width, height) tuple of the image
+
+	Returns:
+	(width, height) tuple of the scaled image
+	"""
+	rs = screen_res[0]/float(screen_res[1])
+	ri = image_res[0]/float(image_res[1])
+
+	if rs > ri:
+		return (int(image_res[0] * screen_res[1]/image_res[1]), screen_res[1])
+	else:
+		return (screen_res[0], int(image_res[1]*screen_res[0]/image_res[0]))
+
+def frame_bytes(width, height):
+	"""
+	Arguments:
+	width -- the width of the frame in px
+	height -- the height of the frame in px
+
+	Returns:
+	The number of bytes in a decoded RGB frame of this size
+	"""
+	# gst pads each row of a 24 bit RGB frame to a multiple of 4 bytes
+	return ((width * 3 + 3) & ~3) * height
+
+def frame_to_array(data, width, height):
+	"""
+	Wraps the contents of a decoded RGB frame in a numpy array without copying it
+
+	Arguments:
+	data -- the frame data as a str/bytes object
+	width -- the width of the frame in px
+	height -- the height of the frame in px
+
+	Returns:
+	A read-only (height, width, 3) uint8 array
+	"""
+	rowstride = frame_bytes(width, height) / height
+	rows = np.frombuffer(data, dtype=np.uint8, count=rowstride*height).reshape(height, rowstride)
+	return rows[:, :width*3].reshape(height, width, 3)
+
+
+#---------------------------------------------------------------------
+# Profiling -- measures how long each stage of playback takes
+#---------------------------------------------------------------------
+
+class null_span(object):
+	"""A span that does nothing, used when no span consumers are registered"""
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+class timed_span(object):
+	"""Measures the time spent in a with block and reports it to the profiler"""
+
+	def __init__(self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+
+	def __enter__(self):
+		self.start = default_timer()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.profiler.emit(self.name, self.start, default_timer())
+		return False
+
+class span_profiler(object):
+	"""
+	Passes the timing of named spans of code to the registered consumers. Spans are marked with
+
+		with profiler.span("name"):
+			...
+
+	When no consumers are registered, span() returns a shared null_span, so the cost of
+	an instrumented block is no more than a method call.
+	"""
+
+	def __init__(self):
+		self.consumers = []
+		self.__null_span = null_span()
+
+	def add_consumer(self, consumer):
+		"""
+		Arguments:
+		consumer -- a callable that is called with the name, start time, end time (in seconds)
+			and thread id of each span
+		"""
+		self.consumers.append(consumer)
+
+	def remove_consumer(self, consumer):
+		"""
+		Arguments:
+		consumer -- a previously added consumer
+		"""
+		self.consumers.remove(consumer)
+
+	def span(self, name):
+		"""
+		Arguments:
+		name -- the name of the span
+
+		Returns:
+		A context manager that times the code in its with block
+		"""
+		if not self.consumers:
+			return self.__null_span
+		return timed_span(self, name)
+
+	def emit(self, name, start, end):
+		"""
+		Passes a span to all consumers
+
+		Arguments:
+		name -- the name of the span
+		start -- the start time of the span in seconds
+		end -- the end time of the span in seconds
+		"""
+		thread_id = thread.get_ident()
+		for consumer in self.consumers:
+			consumer(name, start, end, thread_id)
+
+class chrome_trace(object):
+	"""
+	Span consumer that collects spans and saves them in the Chrome trace event format,
+	which can be viewed in chrome://tracing
+	"""
+
+	def __init__(self, path):
+		"""
+		Arguments:
+		path -- the file to save the trace to
+		"""
+		self.path = path
+		self.pid = os.getpid()
+		self.events = []
+
+	def __call__(self, name, start, end, thread_id):
+		"""Collects a span (called by the profiler)"""
+		# Timestamps and durations are in microseconds
+		self.events.append({"name": name, "cat": "media_player_gst", "ph": "X",
+			"ts": start*10**6, "dur": (end-start)*10**6, "pid": self.pid, "tid": thread_id})
+
+	def save(self):
+		"""Writes the collected spans to the trace file"""
+		with open(self.path, "w") as f:
+			json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+# The profiler to which all spans of playback are reported
+profiler = span_profiler()
+
+
+#---------------------------------------------------------------------
+# Overlay -- a drawing layer on top of the video frames
+#---------------------------------------------------------------------
+
+class overlay(object):
+	"""
+	A transparent layer, the size of the display, that is drawn on top of each video frame.
+	Drawing commands resemble those of the OpenSesame canvas, with coordinates in pixels from
+	the top-left of the display. The commands are rasterized only once after the overlay has
+	changed; for every frame in between, the handlers composite the cached result.
+	"""
+
+	def __init__(self, size):
+		"""
+		Constructor.
+
+		Arguments:
+		size -- (width, height) tuple of the display
+		"""
+		self.size = size
+		self.commands = []
+		self.version = 0			# Incremented on every change
+		self.surface = None
+		self._surface_version = None
+		self.reset_stats()
+
+	def reset_stats(self):
+		"""Resets the compositing time measurements"""
+		self.rasterize_count = 0
+		self.composite_time = 0.0
+		self.composite_count = 0
+
+	def __add(self, command, *args):
+		"""
+		Adds a drawing command
+
+		Arguments:
+		command -- the name of the command
+		*args -- the arguments of the command
+		"""
+		self.commands.append((command,) + args)
+		self.version += 1
+
+	def clear(self):
+		"""Removes everything from the overlay"""
+		if self.commands:
+			self.commands = []
+			self.version += 1
+
+	def is_empty(self):
+		"""
+		Returns:
+		True if nothing has been drawn on the overlay
+		"""
+		return not self.commands
+
+	def rect(self, x, y, w, h, color = "white", fill = False, penwidth = 1):
+		"""
+		Draws a rectangle
+
+		Arguments:
+		x -- the left of the rectangle
+		y -- the top of the rectangle
+		w -- the width of the rectangle
+		h -- the height of the rectangle
+
+		Keyword arguments:
+		color -- a color name, "#rrggbb" or (r, g, b[, a]) tuple (default = "white")
+		fill -- fill the rectangle (default = False)
+		penwidth -- the width of the outline (default = 1)
+		"""
+		self.__add("rect", (x, y, w, h), color, fill, penwidth)
+
+	def ellipse(self, x, y, w, h, color = "white", fill = False, penwidth = 1):
+		"""
+		Draws an ellipse within a bounding rectangle
+
+		Arguments:
+		x -- the left of the bounding rectangle
+		y -- the top of the bounding rectangle
+		w -- the width of the ellipse
+		h -- the height of the ellipse
+
+		Keyword arguments:
+		color -- a color name, "#rrggbb" or (r, g, b[, a]) tuple (default = "white")
+		fill -- fill the ellipse (default = False)
+		penwidth -- the width of the outline (default = 1)
+		"""
+		self.__add("ellipse", (x, y, w, h), color, fill, penwidth)
+
+	def circle(self, x, y, r, color = "white", fill = False, penwidth = 1):
+		"""
+		Draws a circle
+
+		Arguments:
+		x -- the x coordinate of the center
+		y -- the y coordinate of the center
+		r -- the radius
+
+		Keyword arguments:
+		color -- a color name, "#rrggbb" or (r, g, b[, a]) tuple (default = "white")
+		fill -- fill the circle (default = False)
+		penwidth -- the width of the outline (default = 1)
+		"""
+		self.ellipse(x-r, y-r, 2*r, 2*r, color, fill, penwidth)
+
+	def line(self, sx, sy, ex, ey, color = "white", penwidth = 1):
+		"""
+		Draws a line
+
+		Arguments:
+		sx -- the x coordinate of the start
+		sy -- the y coordinate of the start
+		ex -- the x coordinate of the end
+		ey -- the y coordinate of the end
+
+		Keyword arguments:
+		color -- a color name, "#rrggbb" or (r, g, b[, a]) tuple (default = "white")
+		penwidth -- the width of the line (default = 1)
+		"""
+		self.__add("line", (sx, sy), (ex, ey), color, penwidth)
+
+	def text(self, text, x, y, color = "white", font_size = 18, center = True):
+		"""
+		Draws text
+
+		Arguments:
+		text -- the text
+		x -- the x coordinate
+		y -- the y coordinate
+
+		Keyword arguments:
+		color -- a color name, "#rrggbb" or (r, g, b[, a]) tuple (default = "white")
+		font_size -- the font size in px (default = 18)
+		center -- center the text on x, y instead of placing its top-left there (default = True)
+		"""
+		self.__add("text", unicode(text), (x, y), color, font_size, center)
+
+	def image(self, path, x, y, center = True):
+		"""
+		Draws an image (which may be partly transparent)
+
+		Arguments:
+		path -- the path to the image file
+		x -- the x coordinate
+		y -- the y coordinate
+
+		Keyword arguments:
+		center -- center the image on x, y instead of placing its top-left there (default = True)
+		"""
+		self.__add("image", pygame.image.load(path), (x, y), center)
+
+	def rasterize(self):
+		"""
+		Draws the commands on a transparent surface, if the overlay changed since it was last rasterized
+
+		Returns:
+		The surface
+		"""
+		if self._surface_version == self.version:
+			return self.surface
+
+		with profiler.span("overlay_rasterize"):
+			surface = pygame.Surface(self.size, pygame.SRCALPHA, 32)
+			surface.fill((0, 0, 0, 0))
+			for command in self.commands:
+				if command[0] == "rect":
+					rect, color, fill, penwidth = command[1:]
+					pygame.draw.rect(surface, self.__color(color), rect, 0 if fill else penwidth)
+				elif command[0] == "ellipse":
+					rect, color, fill, penwidth = command[1:]
+					pygame.draw.ellipse(surface, self.__color(color), rect, 0 if fill else penwidth)
+				elif command[0] == "line":
+					start, end, color, penwidth = command[1:]
+					pygame.draw.line(surface, self.__color(color), start, end, penwidth)
+				elif command[0] == "text":
+					text, pos, color, font_size, center = command[1:]
+					if not pygame.font.get_init():
+						pygame.font.init()
+					rendered = pygame.font.Font(None, font_size).render(text, True, self.__color(color))
+					surface.blit(rendered, self.__topleft(rendered, pos, center))
+				elif command[0] == "image":
+					image, pos, center = command[1:]
+					surface.blit(image, self.__topleft(image, pos, center))
+
+		self.surface = surface
+		self._surface_version = self.version
+		self.rasterize_count += 1
+		return surface
+
+	def __color(self, color):
+		"""
+		Arguments:
+		color -- a color name, "#rrggbb" or (r, g, b[, a]) tuple
+
+		Returns:
+		The pygame color
+		"""
+		if isinstance(color, basestring):
+			return pygame.Color(str(color))
+		return pygame.Color(*color)
+
+	def __topleft(self, surface, pos, center):
+		"""
+		Arguments:
+		surface -- the surface that is placed
+		pos -- the (x, y) position
+		center -- whether the surface is centered on the position
+
+		Returns:
+		The top-left coordinate of the surface
+		"""
+		if center:
+			return (pos[0] - surface.get_width() / 2, pos[1] - surface.get_height() / 2)
+		return pos
+
+
+#---------------------------------------------------------------------
+# Cues -- actions that are performed when specific frames are shown
+#---------------------------------------------------------------------
+
+# The actions that a cue can perform
+CUE_ACTIONS = ("trigger", "log", "pause", "stop")
+
+class cue_table(object):
+	"""
+	A table of cues, each of which performs an action when a specific frame is shown. Cues are
+	defined with one line per cue: `frame <number> <action> [value]` or `time <seconds> <action> [value]`.
+	Frames are numbered from 1, and a time cue is performed when the first frame with a timestamp at
+	or after it is shown. The cues are indexed by frame number, so that finding the cues of a frame
+	does not depend on the number of cues.
+	"""
+
+	def __init__(self, definition, fps):
+		"""
+		Constructor.
+
+		Arguments:
+		definition -- the cue definitions, one per line (empty lines and lines starting with # are skipped)
+		fps -- the frame rate of the video, to convert times to frame numbers
+		"""
+		self.fps = fps
+		self.cues = []			# (frame, action, value, definition) tuples, sorted by frame
+		for line_no, line in enumerate(definition.splitlines()):
+			line = line.strip()
+			if line == u"" or line.startswith(u"#"):
+				continue
+			self.cues.append(self.__parse(line, line_no + 1))
+		self.cues.sort(key = lambda cue: cue[0])
+		self.frames = [cue[0] for cue in self.cues]
+		self.reset()
+
+	def __parse(self, line, line_no):
+		"""
+		Arguments:
+		line -- the definition of a cue
+		line_no -- the line number of the definition, for error messages
+
+		Returns:
+		A (frame, action, value, definition) tuple
+		"""
+		parts = line.split(None, 3)
+		if len(parts) < 3 or not parts[0] in (u"frame", u"time") or not parts[2] in CUE_ACTIONS:
+			raise osexception(u"Invalid cue on line %d: '%s'. Cues should be defined as 'frame <number> <action> [value]' "
+				u"or 'time <seconds> <action> [value]', with action one of %s." % (line_no, line, u", ".join(CUE_ACTIONS)))
+		try:
+			if parts[0] == u"frame":
+				frame = int(parts[1])
+			else:
+				# The first frame that starts at or after the time (allowing for rounding of timestamps)
+				frame = int(np.ceil(float(parts[1]) * self.fps - 1e-3)) + 1
+		except ValueError:
+			raise osexception(u"Invalid %s '%s' in cue on line %d: '%s'" % (parts[0], parts[1], line_no, line))
+
+		value = parts[3] if len(parts) > 3 else None
+		if parts[2] == u"trigger" and not value is None:
+			# Trigger values are usually numbers, such as the value to write to a port
+			for convert in (int, float):
+				try:
+					value = convert(value)
+					break
+				except ValueError:
+					pass
+		return (frame, parts[2], value, line)
+
+	def __len__(self):
+		return len(self.cues)
+
+	def has_action(self, action):
+		"""
+		Arguments:
+		action -- the name of an action
+
+		Returns:
+		True if a cue performs the action
+		"""
+		return any(cue[1] == action for cue in self.cues)
+
+	def reset(self):
+		"""Starts over, for when the video is played from the start (or the end) again"""
+		self.last_frame = None
+
+	def frame_number(self, pts):
+		"""
+		Arguments:
+		pts -- the timestamp of a frame in ns
+
+		Returns:
+		The number of the frame in the video (counted from 1)
+		"""
+		return int(round(pts * self.fps / gst.SECOND)) + 1
+
+	def shown(self, pts, rate):
+		"""
+		Finds the cues of the frames that have been passed since the previously shown frame, in
+		the direction of playback, so that no cues are skipped when frames are dropped.
+
+		Arguments:
+		pts -- the timestamp of the frame that is shown, in ns
+		rate -- the playback rate
+
+		Returns:
+		The (frame, action, value, definition) tuples of the cues to perform
+		"""
+		frame = self.frame_number(pts)
+		last_frame, self.last_frame = self.last_frame, frame
+		if last_frame is None:
+			# Playback starts here, so the cues of the frames before it (or, in reverse, after it) are performed too
+			if rate > 0:
+				return self.cues[:bisect.bisect_right(self.frames, frame)]
+			return self.cues[bisect.bisect_left(self.frames, frame):]
+		if frame > last_frame:
+			return self.cues[bisect.bisect_right(self.frames, last_frame):bisect.bisect_right(self.frames, frame)]
+		if frame < last_frame:
+			return self.cues[bisect.bisect_left(self.frames, frame):bisect.bisect_left(self.frames, last_frame)]
+		return []
+
+
 #---------------------------------------------------------------------
 # Base classes (should be subclassed by backend-specific classes)
 #---------------------------------------------------------------------
@@ -127,17 +730,22 @@ class pygame_handler(object):
 		self.main_player = main_player
 		self.screen = screen
 		self.custom_event_code = custom_event_code
+		self.latest_frame = (None, None)	# The most recent frame and its timestamp
+		self.drawn_pts = None				# The timestamp of the frame that was drawn last
 
-	def handle_videoframe(self, frame):
+	def handle_videoframe(self, frame, pts = None):
 		"""
 		Callback method for handling a video frame
 
 		Arguments:
 		frame - the video frame supplied as a str/bytes object
-		frame_on_time - (True|False) indicates if renderer is lagging behind
-			internal frame counter of the player (False) or is still in sync (True)
+
+		Keyword arguments:
+		pts - the timestamp of the frame in ns (default = None)
 		"""
-		self.frame = frame
+		# The frame and its timestamp are stored together, so that draw_frame()
+		# always knows the timestamp of the frame that it draws
+		self.latest_frame = (frame, pts)
 
 	def swap_buffers(self):
 		"""
@@ -243,10 +851,18 @@ class pygame_handler(object):
 		paused = self.main_player.paused # for checking if player is currently paused or not
 		pause = self.main_player.pause
 
+		# Playback rate, which can be changed with set_rate(rate)
+		rate = self.main_player.rate
+		set_rate = self.main_player.set_rate
+
+		# Layer to draw on top of the frames
+		overlay = self.main_player.overlay
+
 		# Add more convenience functions?
 
 		try:
-			exec(self.custom_event_code)
+			with profiler.span("exec"):
+				exec(self.custom_event_code)
 		except Exception as e:
 			self.main_player.playing = False
 			raise osexception(u"Error while executing event handling code: %s" % e)
@@ -295,6 +911,22 @@ class OpenGL_renderer(object):
 
 		GL.glClear(GL.GL_COLOR_BUFFER_BIT|GL.GL_DEPTH_BUFFER_BIT)
 
+		# The overlay texture is only uploaded once the overlay has been drawn on
+		self.overlay_version = None
+
+	def set_fast_scaling(self, enabled):
+		"""
+		Switches between smooth (linear) and fast (nearest neighbour) scaling of the frames
+
+		Arguments:
+		enabled -- whether fast scaling should be used
+		"""
+		GL = self.GL
+		interpolation = GL.GL_NEAREST if enabled else GL.GL_LINEAR
+		GL.glBindTexture(GL.GL_TEXTURE_2D, self.texid)
+		GL.glTexParameterf(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, interpolation)
+		GL.glTexParameterf(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, interpolation)
+
 	def playback_finished(self):
 		""" Restore previous OpenGL context as before playback """
 		GL = self.GL
@@ -318,9 +950,12 @@ class OpenGL_renderer(object):
 		GL.glColor4f(1,1,1,1)
 
 		# Only if a frame has been set, blit it to the texture
-		if hasattr(self,"frame") and not self.frame is None:
+		GL.glBindTexture(GL.GL_TEXTURE_2D, self.texid)
+		frame, pts = self.latest_frame
+		if not frame is None:
 			GL.glLoadIdentity()
-			GL.glTexSubImage2D( GL.GL_TEXTURE_2D, 0, 0, 0, self.main_player.vidsize[0], self.main_player.vidsize[1], GL.GL_RGB, GL.GL_UNSIGNED_BYTE, self.frame)
+			GL.glTexSubImage2D( GL.GL_TEXTURE_2D, 0, 0, 0, self.main_player.vidsize[0], self.main_player.vidsize[1], GL.GL_RGB, GL.GL_UNSIGNED_BYTE, frame)
+			self.drawn_pts = pts
 
 		# Drawing of the quad on which the frame texture is projected
 		GL.glBegin(GL.GL_QUADS)
@@ -330,9 +965,46 @@ class OpenGL_renderer(object):
 		GL.glTexCoord2f(0.0, 1.0); GL.glVertex3i(x, y+h, 0)
 		GL.glEnd()
 
+		if not self.main_player.overlay.is_empty():
+			self.draw_overlay()
+
 		# Make sure there are no pending drawing operations and flip front and backbuffer
 		GL.glFlush()
 
+	def draw_overlay(self):
+		"""
+		Blends the overlay over the frame. The overlay is only uploaded to its texture again when it has changed.
+		"""
+		GL = self.GL
+		overlay = self.main_player.overlay
+		(w,h) = overlay.size
+
+		start = default_timer()
+		with profiler.span("overlay"):
+			if not hasattr(self, "overlay_texid"):
+				self.overlay_texid = self.new_texture()
+			GL.glBindTexture(GL.GL_TEXTURE_2D, self.overlay_texid)
+			if self.overlay_version != overlay.version:
+				data = pygame.image.tostring(overlay.rasterize(), "RGBA")
+				GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, w, h, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, data)
+				GL.glTexParameterf(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+				GL.glTexParameterf(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+				self.overlay_version = overlay.version
+
+			# The back-end may rely on its own blending settings, so restore them afterwards
+			GL.glPushAttrib(GL.GL_ENABLE_BIT | GL.GL_COLOR_BUFFER_BIT)
+			GL.glEnable(GL.GL_BLEND)
+			GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+			GL.glBegin(GL.GL_QUADS)
+			GL.glTexCoord2f(0.0, 0.0); GL.glVertex3i(0, 0, 0)
+			GL.glTexCoord2f(1.0, 0.0); GL.glVertex3i(w, 0, 0)
+			GL.glTexCoord2f(1.0, 1.0); GL.glVertex3i(w, h, 0)
+			GL.glTexCoord2f(0.0, 1.0); GL.glVertex3i(0, h, 0)
+			GL.glEnd()
+			GL.glPopAttrib()
+		overlay.composite_time += default_timer() - start
+		overlay.composite_count += 1
+
 
 #---------------------------------------------------------------------
 # Backend specific classes
@@ -374,18 +1046,30 @@ class legacy_handler(pygame_handler):
 		# Fill surface with background color
 		self.screen.fill(pygame.Color(str(self.main_player.experiment.background)))
 		self.last_drawn_frame_no = 0
+		self.overlay_version = self.main_player.overlay.version
 
 	def draw_frame(self):
 		"""
 		Does the actual rendering of the buffer to the screen
 		"""
 
-		if hasattr(self,"frame") and not self.frame is None:
+		frame, pts = self.latest_frame
+		if not frame is None:
 			# Only draw each frame to screen once, to give the pygame (software-based) rendering engine
-			# some breathing space
-			if self.last_drawn_frame_no != self.main_player.frame_no:
+			# some breathing space (unless the overlay has changed)
+			overlay = self.main_player.overlay
+			if self.last_drawn_frame_no != self.main_player.frame_no or self.overlay_version != overlay.version:
+				# Remove what has been drawn on the overlay outside of the video
+				if self.overlay_version != overlay.version:
+					self.screen.fill(pygame.Color(str(self.main_player.experiment.background)))
+
 				# Write the video frame to the bufferproxy
-				self.imgBuffer.write(self.frame, 0)
+				# (Frames from a decoder process are arrays, which the bufferproxy does not accept)
+				if isinstance(frame, np.ndarray):
+					self.imgBuffer.write(frame.tostring(), 0)
+				else:
+					self.imgBuffer.write(frame, 0)
+				self.drawn_pts = pts
 
 				# If resize option is selected, resize frame to screen/window dimensions and blit
 				if hasattr(self, "dest_surface"):
@@ -395,7 +1079,15 @@ class legacy_handler(pygame_handler):
 				# In case movie needs to be displayed 1-on-1 blit directly to screen
 					self.screen.blit(self.img.copy(), self.main_player.vidPos)
 
+				if not overlay.is_empty():
+					start = default_timer()
+					with profiler.span("overlay"):
+						self.screen.blit(overlay.rasterize(), (0, 0))
+					overlay.composite_time += default_timer() - start
+					overlay.composite_count += 1
+
 				self.last_drawn_frame_no = self.main_player.frame_no
+				self.overlay_version = overlay.version
 
 
 class expyriment_handler(OpenGL_renderer, pygame_handler):
@@ -411,7 +1103,14 @@ class expyriment_handler(OpenGL_renderer, pygame_handler):
 
 		# GL context to use by the OpenGL_renderer class
 		self.GL = GL
-		self.texid = GL.glGenTextures(1)
+		self.texid = self.new_texture()
+
+	def new_texture(self):
+		"""
+		Returns:
+		The id of a newly generated texture
+		"""
+		return self.GL.glGenTextures(1)
 
 
 class psychopy_handler(OpenGL_renderer):
@@ -430,30 +1129,42 @@ class psychopy_handler(OpenGL_renderer):
 		Keyword arguments:
 		custom_event_code -- (Compiled) code that is to be called after every frame
 		"""
-		import ctypes
 		import pyglet.gl
 
 		self.main_player = main_player
 		self.win = screen
-		self.frame = None
+		self.latest_frame = (None, None)	# The most recent frame and its timestamp
+		self.drawn_pts = None				# The timestamp of the frame that was drawn last
 		self.custom_event_code = custom_event_code
 
 		# GL context to be used by the OpenGL_renderer class
 		# Create texture to render frames to later
-		GL = self.GL = pyglet.gl
-		self.texid = GL.GLuint()
-		GL.glGenTextures(1, ctypes.byref(self.texid))
+		self.GL = pyglet.gl
+		self.texid = self.new_texture()
+
+	def new_texture(self):
+		"""
+		Returns:
+		The id of a newly generated texture
+		"""
+		texid = self.GL.GLuint()
+		self.GL.glGenTextures(1, ctypes.byref(texid))
+		return texid
 
-	def handle_videoframe(self, frame):
+	def handle_videoframe(self, frame, pts = None):
 		"""
 		Callback method for handling a video frame
 
 		Arguments:
-		frame - the video frame supplied as a str/bytes object
-		frame_on_time - (True|False) indicates if renderer is lagging behind
-			internal frame counter of the player (False) or is still in sync (True)
+		frame - the video frame supplied as a str/bytes object, or as an array (from a decoder process)
+
+		Keyword arguments:
+		pts - the timestamp of the frame in ns (default = None)
 		"""
-		self.frame = frame
+		# pyglet does not accept arrays, but does accept a pointer to their data
+		if isinstance(frame, np.ndarray):
+			frame = frame.ctypes.data_as(ctypes.c_void_p)
+		self.latest_frame = (frame, pts)
 
 	def swap_buffers(self):
 		"""Draw buffer to screen"""
@@ -523,11 +1234,19 @@ class psychopy_handler(OpenGL_renderer):
 		paused = self.main_player.paused
 		pause = self.main_player.pause
 
+		# Playback rate, which can be changed with set_rate(rate)
+		rate = self.main_player.rate
+		set_rate = self.main_player.set_rate
+
+		# Layer to draw on top of the frames
+		overlay = self.main_player.overlay
+
 		# Add more convenience functions?
 
 		# Execute custom code
 		try:
-			exec(self.custom_event_code)
+			with profiler.span("exec"):
+				exec(self.custom_event_code)
 		except Exception as e:
 			self.main_player.playing = False
 			raise osexception(u"Error while executing event handling code: %s" % e)
@@ -539,27 +1258,1661 @@ class psychopy_handler(OpenGL_renderer):
 		return continue_playback
 
 #---------------------------------------------------------------------
-# Main player class -- communicates with GStreamer
+# GLib main loop -- shared by all pipelines of the process
 #---------------------------------------------------------------------
 
-class media_player_gst(item.item, generic_response.generic_response):
+class main_loop_service(object):
+	"""
+	Runs the single GLib main loop of the process, which handles the events of all
+	pipelines. Pipelines are owned through reference counts: the loop is started when
+	the first pipeline is acquired and stopped when the last one has been released. A
+	pipeline is set to STATE_NULL, and the state change is waited for, as soon as its
+	last reference is released, so that its threads and files are freed deterministically.
+	"""
 
-	"""The media_player plug-in offers advanced video playback functionality in OpenSesame using the GStreamer framework"""
+	# How long to wait for a pipeline to reach STATE_NULL, or for the loop to stop (in seconds)
+	TIMEOUT = 5
 
-	def __init__(self, name, experiment, string = None):
+	def __init__(self):
+		"""Constructor."""
+		self._lock = threading.RLock()
+		self._pipelines = {}		# [pipeline, reference count] by id
+		self._loop = None
+		self._thread = None
+		self._threads_initialized = False
+
+	def acquire(self, pipeline):
 		"""
-		Constructor.
+		Adds a reference to a pipeline and makes sure the main loop is running
 
 		Arguments:
-		name -- the name of the item
-		experiment -- the opensesame experiment
-
-		Keyword arguments:
-		string -- a definition string for the item (Default = None)
+		pipeline -- the pipeline
 		"""
+		with self._lock:
+			entry = self._pipelines.setdefault(id(pipeline), [pipeline, 0])
+			entry[1] += 1
+			if self._loop is None:
+				self.__start()
 
-		# The version of the plug-in
-		self.version = "1.0"
+	def release(self, pipeline):
+		"""
+		Removes a reference to a pipeline. When it was the last one, the pipeline is stopped,
+		and when no pipelines remain, the main loop is stopped too. Releasing a pipeline that
+		is not owned does nothing, so that it is safe to close a source more than once.
+
+		Arguments:
+		pipeline -- the pipeline
+		"""
+		with self._lock:
+			entry = self._pipelines.get(id(pipeline))
+			if entry is None:
+				return
+			entry[1] -= 1
+			if entry[1] > 0:
+				return
+			del self._pipelines[id(pipeline)]
+			pipeline.set_state(gst.STATE_NULL)
+			if pipeline.get_state(self.TIMEOUT * gst.SECOND)[0] != gst.STATE_CHANGE_SUCCESS:
+				debug.msg(u"main_loop_service: pipeline '%s' did not stop in time" % pipeline.get_name())
+			if not self._pipelines:
+				self.__stop()
+
+	def shutdown(self):
+		"""
+		Stops all pipelines that are still owned (for instance because playback was aborted) and the main loop
+
+		Returns:
+		True, as required for a cleanup function of the experiment
+		"""
+		with self._lock:
+			for pipeline, count in self._pipelines.values():
+				pipeline.set_state(gst.STATE_NULL)
+				pipeline.get_state(self.TIMEOUT * gst.SECOND)
+			self._pipelines.clear()
+			self.__stop()
+		return True
+
+	def is_running(self):
+		"""
+		Returns:
+		True if the main loop is running
+		"""
+		loop = self._loop
+		return not loop is None and loop.is_running()
+
+	def owned(self):
+		"""
+		Returns:
+		The number of pipelines that are owned
+		"""
+		return len(self._pipelines)
+
+	def __start(self):
+		"""Starts the main loop in a thread, and waits until it runs"""
+		if not self._threads_initialized:
+			gobject.threads_init()
+			self._threads_initialized = True
+		self._loop = gobject.MainLoop()
+		self._thread = threading.Thread(target = self._loop.run, name = "gst main loop")
+		self._thread.daemon = True
+		self._thread.start()
+		# A quit() before run() has started would be lost, so only return once the loop runs
+		started = threading.Event()
+		gobject.idle_add(lambda: started.set() or False)
+		if not started.wait(self.TIMEOUT):
+			debug.msg(u"main_loop_service: the main loop did not start in time")
+
+	def __stop(self):
+		"""Stops the main loop and waits for its thread to finish"""
+		if self._loop is None:
+			return
+		self._loop.quit()
+		if not self._thread is threading.current_thread():
+			self._thread.join(self.TIMEOUT)
+		self._loop = None
+		self._thread = None
+
+# The main loop that all pipelines in the process use
+main_loop = main_loop_service()
+
+
+#---------------------------------------------------------------------
+# Read-ahead buffering -- feeds a video file to GStreamer from memory
+#---------------------------------------------------------------------
+
+class readahead_reader(object):
+	"""
+	Reads a video file ahead of the playback position in a separate thread, and feeds it
+	to the player through an appsrc element (which playbin2 creates for appsrc:// URIs).
+	This prevents playback from stalling when reading from slow (e.g. network mounted) storage
+	is temporarily delayed.
+	"""
+
+	def __init__(self, path, budget, chunk_size = 64*1024, use_mmap = False, file = None):
+		"""
+		Constructor. Starts reading the file right away.
+
+		Arguments:
+		path -- the path to the video file
+		budget -- the maximum number of bytes to read ahead
+
+		Keyword arguments:
+		chunk_size -- the number of bytes to read at once (default = 64 KB)
+		use_mmap -- memory map the file instead of reading it (default = False)
+		file -- the opened file to read from, e.g. a throttled_file (see media_player_gst_diagnostics) to simulate slow
+			storage (default = None, path is opened)
+		"""
+		self.path = path
+		self.size = os.path.getsize(path)
+		self.budget = budget
+		self.chunk_size = chunk_size
+
+		self.chunks = collections.deque()	# The read but not yet consumed chunks
+		self.level = 0						# The number of bytes in chunks
+		self.offset = 0						# The file position at which the next chunk is read
+		self.eof = False
+		self.generation = 0					# Incremented on every seek to discard chunks that are being read
+		self.refilling = False				# True after a seek, until the buffer has data again
+		self.running = True
+		self.condition = threading.Condition()
+		self.reset_stats()
+
+		self.file = open(path, "rb") if file is None else file
+		if use_mmap:
+			self.source = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		else:
+			self.source = None
+
+		self.thread = threading.Thread(target=self.__read_loop)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def reset_stats(self):
+		"""Resets the underrun count and buffer level statistics (e.g. at the start of playback)"""
+		with self.condition:
+			self.underruns = 0
+			self.min_level = None
+			self.level_sum = 0
+			self.level_count = 0
+
+	def set_budget(self, budget):
+		"""
+		Arguments:
+		budget -- the maximum number of bytes to read ahead
+		"""
+		with self.condition:
+			self.budget = budget
+			self.condition.notify_all()
+
+	def wait_for_level(self, target, timeout):
+		"""
+		Blocks until the given number of bytes has been read ahead, or the end of the file has been reached
+
+		Arguments:
+		target -- the number of bytes to wait for
+		timeout -- the maximum time to wait in seconds
+
+		Returns:
+		True if the target was reached, False if the wait timed out
+		"""
+		deadline = time.time() + timeout
+		with self.condition:
+			while self.level < target and not self.eof:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					return False
+				self.condition.wait(remaining)
+		return True
+
+	def configure(self, appsrc):
+		"""
+		Sets up the appsrc element created by playbin2 to pull data from this reader
+
+		Arguments:
+		appsrc -- the appsrc element
+		"""
+		appsrc.set_property("size", self.size)
+		# Seekable stream type: data is pushed, but the demuxer may seek in it
+		appsrc.set_property("stream-type", 1)
+		appsrc.connect("need-data", self.__need_data)
+		appsrc.connect("seek-data", self.__seek_data)
+
+	def __read_loop(self):
+		"""Reads chunks from the file until the budget has been filled. Runs in a separate thread."""
+		while True:
+			with self.condition:
+				while self.running and (self.eof or self.level >= self.budget):
+					self.condition.wait()
+				if not self.running:
+					return
+				generation = self.generation
+				offset = self.offset
+
+			# Do the actual (slow) reading without holding the lock
+			if self.source is None:
+				self.file.seek(offset)
+				data = self.file.read(self.chunk_size)
+			else:
+				data = self.source[offset:offset+self.chunk_size]
+
+			with self.condition:
+				# Discard the chunk if a seek happened while it was being read
+				if generation != self.generation:
+					continue
+				if data:
+					self.chunks.append(data)
+					self.level += len(data)
+					self.offset += len(data)
+				if self.offset >= self.size:
+					self.eof = True
+				self.condition.notify_all()
+
+	def __need_data(self, appsrc, length):
+		"""
+		Callback for appsrc when it requires more data. Runs in a gst streaming thread.
+
+		Arguments:
+		appsrc -- the appsrc element that requests data
+		length -- the number of bytes requested (only a hint)
+		"""
+		with self.condition:
+			if not self.chunks and not self.eof:
+				# Playback has caught up with reading: the buffer ran dry. Right after a
+				# seek it is empty by design, so that does not count as an underrun.
+				if not self.refilling:
+					self.underruns += 1
+				while self.running and not self.chunks and not self.eof:
+					self.condition.wait()
+
+			self.level_sum += self.level
+			self.level_count += 1
+			if self.min_level is None or self.level < self.min_level:
+				self.min_level = self.level
+
+			if self.chunks:
+				data = self.chunks.popleft()
+				self.level -= len(data)
+				self.refilling = False
+				self.condition.notify_all()
+			else:
+				data = None
+
+		if data is None:
+			appsrc.emit("end-of-stream")
+		else:
+			appsrc.emit("push-buffer", gst.Buffer(data))
+
+	def __seek_data(self, appsrc, offset):
+		"""
+		Callback for appsrc when the demuxer seeks in the file
+
+		Arguments:
+		appsrc -- the appsrc element
+		offset -- the byte offset to continue reading from
+
+		Returns:
+		True
+		"""
+		with self.condition:
+			self.generation += 1
+			self.chunks.clear()
+			self.level = 0
+			self.refilling = True
+			self.offset = offset
+			self.eof = offset >= self.size
+			self.condition.notify_all()
+		return True
+
+	def close(self):
+		"""Stops reading and closes the file"""
+		with self.condition:
+			if not self.running:
+				return
+			self.running = False
+			self.condition.notify_all()
+		self.thread.join()
+		if not self.source is None:
+			self.source.close()
+		self.file.close()
+
+#---------------------------------------------------------------------
+# Frame sources -- deliver the frames that the handlers draw
+#---------------------------------------------------------------------
+
+class frame_source(object):
+	"""
+	Superclass of the sources that media_player_gst plays frames from: a video file decoded by GStreamer
+	(gst_decoder, or decoder_process to decode in a separate process), a folder of images
+	(image_sequence_source) or an array in memory (array_source). A source passes each new frame to its
+	frame callback, either by itself or when poll() is called by the player loop.
+	"""
+
+	def __init__(self):
+		raise osexception("This class should only be subclassed and not be instantiated directly!")
+
+	def play(self):
+		"""Starts or resumes playback"""
+		raise osexception(u"%s should implement play()" % self.__class__.__name__)
+
+	def pause(self):
+		"""Pauses playback"""
+		raise osexception(u"%s should implement pause()" % self.__class__.__name__)
+
+	def poll(self):
+		"""Called once in every iteration of the player loop. Sources that do not deliver frames by themselves do so here."""
+		pass
+
+	def cpu_time(self):
+		"""
+		Returns:
+		The CPU time in s that the source has used outside of this process (such as in a decoder process)
+		"""
+		return 0.0
+
+	def position(self):
+		"""
+		Returns:
+		The current playback position in ns
+		"""
+		raise osexception(u"%s should implement position()" % self.__class__.__name__)
+
+	def set_rate(self, rate):
+		"""
+		Changes the playback rate from the current position onwards
+
+		Arguments:
+		rate -- the new playback rate
+		"""
+		raise osexception(u"%s should implement set_rate()" % self.__class__.__name__)
+
+	def rewind(self):
+		"""
+		Seeks to the start of the video (or the end of it during reverse playback), keeping the current rate
+		"""
+		raise osexception(u"%s should implement rewind()" % self.__class__.__name__)
+
+	def pop_message(self):
+		"""
+		Returns:
+		("eos",) at the end of the stream, ("error", message, debug_info) on errors and None otherwise
+		"""
+		return None
+
+	def buffer_stats(self):
+		"""
+		Returns:
+		A dict with the underruns, min_level, level_sum and level_count of the buffer
+		that the source reads ahead into, or None if it does not read ahead
+		"""
+		return None
+
+	def reset_buffer_stats(self):
+		"""Resets the statistics of the read-ahead buffer (if any)"""
+		pass
+
+	def audio_stats(self):
+		"""
+		Returns:
+		A dict with the pipeline's reported latency ("latency", in ns), the latency of the audio sink
+		("device_latency", in ns), and the estimated wall time at which the first sound is output ("onset")
+		together with its timestamp ("pts", in ns). The values are None if they are not known.
+		"""
+		return {"latency": None, "device_latency": None, "onset": None, "pts": None}
+
+	def quality_options(self):
+		"""
+		Returns:
+		The names of the options by which the source can lower the cost of decoding (see set_quality_option())
+		"""
+		return []
+
+	def set_quality_option(self, name, enabled):
+		"""
+		Enables or disables an option that lowers the cost of decoding
+
+		Arguments:
+		name -- the name of the option: "skip_frames" to skip decoding frames that other frames
+			do not depend on, or "lowres" to decode at half the resolution
+		enabled -- whether the option should be enabled
+		"""
+		raise osexception(u"%s does not support the quality option '%s'" % (self.__class__.__name__, name))
+
+	def close(self):
+		"""Frees the resources claimed by the source"""
+		pass
+
+
+class gst_decoder(frame_source):
+	"""
+	Decodes a video with a playbin2 pipeline and passes the decoded frames to a callback function.
+	media_player_gst uses it directly, or through decoder_process to decode in a separate process.
+	"""
+
+	def __init__(self, uri, frame_callback, mute = False, readahead = None, buffer_duration = 0, buffer_prefill = 100, audio = None):
+		"""
+		Constructor. Loads the video and prerolls it, after which it is ready for playback.
+
+		Arguments:
+		uri -- the URI of the video file
+		frame_callback -- function that is called with the frame data, its timestamp (in ns),
+			whether it is on time and the number of frames decoded so far, for each decoded frame
+
+		Keyword arguments:
+		mute -- mute the audio (default = False)
+		readahead -- a readahead_reader that supplies the data if uri is appsrc:// (default = None)
+		buffer_duration -- the minimum amount of video to read ahead in seconds (default = 0)
+		buffer_prefill -- the percentage of the read-ahead buffer to fill before playback (default = 100)
+		audio -- a dict with the keyword arguments for make_audio_sink(), or None to use playbin2's default sink (default = None)
+		"""
+		self.frame_callback = frame_callback
+		self.readahead = readahead
+		self.rate = 1.0
+		self.frame_no = 0
+		self.audio_sink = None
+		self._audio_onset = None		# Clock and wall time at which the first audio buffer arrived
+		self._handlers = []			# (element, handler id) of the connected signals
+		self._probe = None
+		self.closed = False
+
+		# Create the audio sink first, as it fails when the sink is not installed. The decoder
+		# owns the read-ahead buffer from here on, so its thread and file are closed in that case.
+		if not audio is None:
+			try:
+				self.audio_sink = make_audio_sink(**audio)
+			except Exception:
+				if not readahead is None:
+					readahead.close()
+				raise
+
+		# Info required for color space conversion (YUV->RGB)
+		caps = gst.Caps(video_caps())
+
+		# Create videoplayer and load URI
+		self.player = gst.element_factory_make("playbin2", "player")
+		self.player.set_property("uri", uri)
+
+		# Enable deinterlacing of video if necessary
+		self.player.props.flags |= (1 << 9)
+
+		# Reroute frame output to Python
+		self._videosink = gst.element_factory_make('appsink', 'videosink')
+		self._videosink.set_property('caps', caps)
+		self._videosink.set_property('async', True)
+		self._videosink.set_property('drop', True)
+		self._videosink.set_property('emit-signals', True)
+
+		# Here the frame output is linked to our custom callback function
+		# which further processes the frame contents
+		self._handlers.append((self._videosink, self._videosink.connect('new-buffer', self.__handle_videoframe)))
+
+		# Let the player output to our just created videosink
+		self.player.set_property('video-sink', self._videosink)
+
+		# Connect the appsrc (which playbin2 creates once it starts) to the read-ahead buffer
+		if not self.readahead is None:
+			self._handlers.append((self.player, self.player.connect('notify::source', self.__setup_source)))
+
+		# Output sound to a configured sink, and watch when the first sound arrives there
+		if not self.audio_sink is None:
+			self.player.set_property('audio-sink', self.audio_sink)
+			self._probe = self.audio_sink.get_static_pad('sink').add_buffer_probe(self.__handle_audiobuffer)
+
+		# Set functions for handling player messages
+		self.bus = self.player.get_bus()
+		self.bus.enable_sync_message_emission()
+
+		# From here on, close() has to be called to free the pipeline
+		main_loop.acquire(self.player)
+
+		# Preroll movie to get dimension data
+		self.player.set_state(gst.STATE_PAUSED)
+
+		# If movie is loaded correctly, info about the clip should be available
+		if self.player.get_state(gst.CLOCK_TIME_NONE)[0] == gst.STATE_CHANGE_SUCCESS:
+			pads = self._videosink.pads()
+			for pad in pads:
+				caps = pad.get_negotiated_caps()[0]
+				for name in caps.keys():
+					debug.msg(u"{0}: {1}".format(name,caps[name]))
+
+				# Video dimensions
+				self.vidsize = caps['width'], caps['height']
+				# Frame rate
+				fps = caps["framerate"]
+				self.fps = (1.0*fps.num/fps.denom)
+
+		else:
+			self.close()
+			raise osexception(u"Failed to open movie. Do you have all the necessary codecs/plugins installed?")
+
+		self.duration = self.player.query_duration(gst.FORMAT_TIME, None)[0]
+
+		if not self.readahead is None:
+			# Convert a time budget for buffering to bytes, using the average bitrate of the file
+			if buffer_duration > 0 and self.duration > 0:
+				bytes_per_sec = self.readahead.size * float(gst.SECOND) / self.duration
+				self.readahead.set_budget(max(self.readahead.budget, int(buffer_duration * bytes_per_sec)))
+
+			# Wait until the requested amount of data has been read ahead
+			prefill = int(self.readahead.budget * buffer_prefill / 100.0)
+			if not self.readahead.wait_for_level(prefill, BUFFER_PREFILL_TIMEOUT):
+				debug.msg(u"gst_decoder: timed out while buffering (%d of %d bytes read ahead)" % (self.readahead.level, prefill))
+
+		# Mute audio if necessary
+		if mute:
+			self.player.set_property("mute", True)
+
+	def __setup_source(self, player, pspec):
+		"""
+		Callback function for when playbin2 has created its source element
+
+		Arguments:
+		player -- the playbin2 element
+		pspec -- the specification of the changed source property
+		"""
+		self.readahead.configure(player.get_property('source'))
+
+	def __handle_videoframe(self, appsink):
+		"""
+		Callback function for GStreamer to pass the decoded videoframe to.
+		This function checks if the frame is not lagging behind to much compared to the
+		player's internal timer and passes it on to the frame callback.
+
+		Arguments
+		appsink 	-- the videosink element that sent the video frame
+		"""
+		# Get buffer from videosink
+		with profiler.span("pull_buffer"):
+			buffer = appsink.emit('pull-buffer')
+
+		# increment frame counter
+		self.frame_no += 1
+
+		# Check if the timestamp of the buffer is not too far behind on the internal clock of the player
+		# If computer is too slow for playing HD movies for instance, we need to drop frames 'manually'
+		# (During reverse playback, frames lag behind when their timestamp is after the player's position.
+		# The allowed lag is in stream time, so it scales with the rate.)
+		lag = self.position() - buffer.timestamp
+		if self.rate < 0:
+			lag = -lag
+		on_time = lag < 10**8 * abs(self.rate)
+
+		self.frame_callback(buffer.data, buffer.timestamp, on_time, self.frame_no)
+
+	def __handle_audiobuffer(self, pad, buffer):
+		"""
+		Buffer probe on the audio sink that registers when the first sound arrives
+
+		Arguments:
+		pad -- the sink pad of the audio sink
+		buffer -- the audio buffer
+
+		Returns:
+		True, to let the buffer pass
+		"""
+		if self._audio_onset is None:
+			clock = self.player.get_clock()
+			if not clock is None:
+				# The wall time is used as it can be compared between processes
+				self._audio_onset = (clock.get_time(), time.time(), self.player.get_base_time(), buffer.timestamp)
+		return True
+
+	def __audio_device_latency(self):
+		"""
+		Returns:
+		The latency-time of the audio sink (the minimum time sound spends in its buffer) in ns, or 0 if unknown
+		"""
+		elements = [self.audio_sink]
+		if isinstance(self.audio_sink, gst.Bin):
+			elements += list(self.audio_sink.recurse())
+		for element in elements:
+			if hasattr(element.props, "latency_time"):
+				return element.get_property("latency-time") * 1000
+		return 0
+
+	def audio_stats(self):
+		"""
+		Returns:
+		A dict with the pipeline's reported latency ("latency", in ns), the latency of the audio sink
+		("device_latency", in ns), and the estimated wall time at which the first sound is output ("onset")
+		together with its timestamp ("pts", in ns). The values are None if they are not known.
+		"""
+		stats = {"latency": None, "device_latency": None, "onset": None, "pts": None}
+		query = gst.query_new_latency()
+		if self.player.query(query):
+			stats["latency"] = query.parse_latency()[1]
+		if not self.audio_sink is None:
+			stats["device_latency"] = self.__audio_device_latency()
+		if not self._audio_onset is None:
+			clock_time, wall_time, base_time, pts = self._audio_onset
+			# A synced sink renders a buffer when the clock reaches base time + running time + latency,
+			# after which the sound spends the device latency in the sink's buffer
+			output_clock_time = base_time + pts + (stats["latency"] or 0) + (stats["device_latency"] or 0)
+			stats["onset"] = wall_time + 1.0*(output_clock_time - clock_time)/gst.SECOND
+			stats["pts"] = pts
+		return stats
+
+	def play(self):
+		"""Starts or resumes playback"""
+		self.player.set_state(gst.STATE_PLAYING)
+
+	def pause(self):
+		"""Pauses playback"""
+		self.player.set_state(gst.STATE_PAUSED)
+
+	def position(self):
+		"""
+		Returns:
+		The current playback position in ns
+		"""
+		return self.player.query_position(gst.FORMAT_TIME, None)[0]
+
+	def set_rate(self, rate):
+		"""
+		Changes the playback rate from the current position onwards
+
+		Arguments:
+		rate -- the new playback rate
+		"""
+		self.seek(rate, self.position())
+
+	def rewind(self):
+		"""
+		Seeks to the start of the video (or the end of it during reverse playback), keeping the current rate
+		"""
+		if self.rate > 0:
+			self.seek(self.rate, 0)
+		else:
+			self.seek(self.rate, self.duration)
+
+	def seek(self, rate, position):
+		"""
+		Performs a seek which also sets the playback rate
+
+		Arguments:
+		rate -- the playback rate
+		position -- the position to continue playback from (in ns)
+		"""
+		flags = gst.SEEK_FLAG_FLUSH
+		if abs(rate) > TRICK_MODE_RATE:
+			# Trick mode: only decode key frames and let elements skip
+			# data, so decoding cost does not grow with the rate
+			flags |= gst.SEEK_FLAG_KEY_UNIT | gst.SEEK_FLAG_SKIP
+		else:
+			flags |= gst.SEEK_FLAG_ACCURATE
+
+		# Playback runs from start to stop, so in reverse the current position is the stop
+		if rate > 0:
+			succeeded = self.player.seek(rate, gst.FORMAT_TIME, flags, gst.SEEK_TYPE_SET, position, gst.SEEK_TYPE_NONE, -1)
+		else:
+			succeeded = self.player.seek(rate, gst.FORMAT_TIME, flags, gst.SEEK_TYPE_SET, 0, gst.SEEK_TYPE_SET, position)
+		if not succeeded:
+			raise osexception(u"Failed to set the playback rate to %s" % rate)
+		self.rate = rate
+
+	def pop_message(self):
+		"""
+		Checks for GST events: end of stream and errors
+
+		Returns:
+		("eos",) at the end of the stream, ("error", message, debug_info) on errors and None otherwise
+		"""
+		# Strangely, pop() is the only method that does not make gstreamer
+		# crash in multiprocessing mode under Ubuntu
+		event = self.bus.pop()
+		if event:
+			if event.type == gst.MESSAGE_EOS:
+				return ("eos",)
+			elif event.type == gst.MESSAGE_ERROR:
+				err, debug_info = event.parse_error()
+				return ("error", unicode(err), debug_info)
+		return None
+
+	def buffer_stats(self):
+		"""
+		Returns:
+		A dict with the underruns, min_level, level_sum and level_count of the
+		read-ahead buffer, or None if the file is not read ahead
+		"""
+		if self.readahead is None:
+			return None
+		return {"underruns": self.readahead.underruns, "min_level": self.readahead.min_level,
+			"level_sum": self.readahead.level_sum, "level_count": self.readahead.level_count}
+
+	def reset_buffer_stats(self):
+		"""Resets the statistics of the read-ahead buffer (if any)"""
+		if not self.readahead is None:
+			self.readahead.reset_stats()
+
+	def __elements_with(self, prop):
+		"""
+		Arguments:
+		prop -- the name of a property (with underscores)
+
+		Returns:
+		The elements in the pipeline that have the property, such as the decoders that support an option
+		"""
+		return [element for element in self.player.recurse() if hasattr(element.props, prop)]
+
+	def quality_options(self):
+		"""
+		Returns:
+		The names of the options that the decoder of the video supports (see set_quality_option())
+		"""
+		options = []
+		if self.__elements_with("skip_frame"):
+			options.append("skip_frames")
+		# Frames decoded at a lower resolution have to be scaled back up before they are delivered
+		scalers = [element for element in self.player.recurse() if element.get_factory().get_name() == "videoscale"]
+		if self.__elements_with("lowres") and scalers:
+			options.append("lowres")
+		return options
+
+	def set_quality_option(self, name, enabled):
+		"""
+		Enables or disables an option that lowers the cost of decoding
+
+		Arguments:
+		name -- "skip_frames" to skip decoding non-reference frames, or "lowres" to decode at half the resolution
+		enabled -- whether the option should be enabled
+		"""
+		if name == "skip_frames":
+			for element in self.__elements_with("skip_frame"):
+				element.set_property("skip-frame", 1 if enabled else 0)
+		elif name == "lowres":
+			# Keep delivering frames at the original size, so that the handlers need not change:
+			# gst scales the smaller frames back up (with the cheapest method while decoding at low resolution)
+			self._videosink.set_property('caps', gst.Caps(video_caps(self.vidsize)))
+			for element in self.player.recurse():
+				if element.get_factory().get_name() == "videoscale":
+					element.set_property("method", 0 if enabled else 1)
+			for element in self.__elements_with("lowres"):
+				element.set_property("lowres", 1 if enabled else 0)
+
+	def close(self):
+		"""
+		Frees the resources claimed by gstreamer and closes the file. The pipeline
+		has stopped when this returns, and it is safe to call this more than once.
+		"""
+		if self.closed:
+			return
+		self.closed = True
+		main_loop.release(self.player)
+		# The signal handlers refer back to this object, so disconnect them to break the cycle
+		for element, handler in self._handlers:
+			element.disconnect(handler)
+		self._handlers = []
+		if not self._probe is None:
+			self.audio_sink.get_static_pad('sink').remove_buffer_probe(self._probe)
+			self._probe = None
+		self.bus.disable_sync_message_emission()
+		if not self.readahead is None:
+			self.readahead.close()
+
+
+class frame_ring(object):
+	"""
+	A ring of frame slots in a memory mapped file, through which a decoder process passes
+	frames to the main process without them having to be copied again. The writer never
+	writes to the slot that was published last, or to the slot that the reader is using.
+	With three slots there is therefore always a slot free to write to.
+	"""
+
+	# Header layout (int64): latest seq, latest slot, reader slot, frames decoded,
+	# followed by a (seq, pts) pair for each slot
+	LATEST_SEQ, LATEST_SLOT, READER_SLOT, DECODED = range(4)
+
+	def __init__(self, path, slots, frame_size, lock, create = False):
+		"""
+		Constructor.
+
+		Arguments:
+		path -- the file that backs the shared memory
+		slots -- the number of frame slots
+		frame_size -- the size of a frame in bytes
+		lock -- a multiprocessing.Lock shared by the reader and the writer
+
+		Keyword arguments:
+		create -- create and initialize the file (done by the writer) (default = False)
+		"""
+		self.path = path
+		self.slots = slots
+		self.lock = lock
+		header_size = 8 * (4 + 2*slots)
+		size = header_size + slots*frame_size
+		if create:
+			with open(path, "wb") as f:
+				f.truncate(size)
+		self.file = open(path, "r+b")
+		self.mm = mmap.mmap(self.file.fileno(), size)
+		self.header = np.frombuffer(self.mm, dtype=np.int64, count=4 + 2*slots)
+		self.frames = [np.frombuffer(self.mm, dtype=np.uint8, count=frame_size, offset=header_size + i*frame_size)
+			for i in range(slots)]
+		if create:
+			self.header[:] = -1
+			self.header[self.DECODED] = 0
+
+	def write(self, data, pts, seq, decoded):
+		"""
+		Copies a frame into a free slot and publishes it (called by the writer)
+
+		Arguments:
+		data -- the frame data
+		pts -- the timestamp of the frame in ns
+		seq -- the sequence number of the frame, which should increase with each frame
+		decoded -- the number of frames decoded so far
+		"""
+		header = self.header
+		with self.lock:
+			busy = (header[self.LATEST_SLOT], header[self.READER_SLOT])
+			slot = [i for i in range(self.slots) if not i in busy][0]
+			# Mark the slot as being written
+			header[4 + 2*slot] = -1
+		self.frames[slot][:] = np.frombuffer(data, dtype=np.uint8, count=len(self.frames[slot]))
+		with self.lock:
+			header[4 + 2*slot] = seq
+			header[5 + 2*slot] = pts
+			header[self.LATEST_SLOT] = slot
+			header[self.LATEST_SEQ] = seq
+			header[self.DECODED] = decoded
+
+	def read(self, last_seq):
+		"""
+		Claims the most recently published frame (called by the reader). The frame remains
+		valid until the next frame is read.
+
+		Arguments:
+		last_seq -- the sequence number of the frame that was read last
+
+		Returns:
+		A (seq, pts, decoded, frame) tuple, with frame a view on the shared memory,
+		or None if no new frame has been published
+		"""
+		header = self.header
+		with self.lock:
+			seq = header[self.LATEST_SEQ]
+			if seq < 0 or seq == last_seq:
+				return None
+			slot = header[self.LATEST_SLOT]
+			header[self.READER_SLOT] = slot
+			return seq, header[5 + 2*slot], header[self.DECODED], self.frames[slot]
+
+	def close(self):
+		"""Unmaps the shared memory"""
+		del self.header, self.frames
+		self.mm.close()
+		self.file.close()
+
+
+def decoder_process_main(conn, lock, src, mute, buffering, buffer_duration, buffer_prefill, audio, slots):
+	"""
+	The main function of a decoder process. Decodes the video with a gst_decoder, writes the
+	frames to a frame_ring and executes the commands it receives from the main process.
+
+	Arguments:
+	conn -- the pipe connection to the main process
+	lock -- the lock of the frame ring
+	src -- the path to the video file
+	mute -- mute the audio
+	buffering -- a (budget, use_mmap) tuple for a readahead_reader, or None to not read ahead
+	buffer_duration -- the minimum amount of video to read ahead in seconds
+	buffer_prefill -- the percentage of the read-ahead buffer to fill before playback
+	audio -- a dict with the keyword arguments for make_audio_sink(), or None
+	slots -- the number of slots in the frame ring
+	"""
+	gobject.threads_init()
+	ring = None
+	state = {"seq": 0}
+	def write_frame(data, pts, on_time, frame_no):
+		# Frames that are too late are never shown, so don't bother passing them on
+		if on_time and not ring is None:
+			state["seq"] += 1
+			ring.write(data, pts, state["seq"], frame_no)
+
+	try:
+		if buffering is None:
+			readahead = None
+			uri = file_uri(src)
+		else:
+			readahead = readahead_reader(src, buffering[0], use_mmap=buffering[1])
+			uri = u"appsrc://"
+		decoder = gst_decoder(uri, write_frame, mute, readahead, buffer_duration, buffer_prefill, audio)
+	except Exception as e:
+		conn.send(("error", unicode(e), ""))
+		return
+
+	try:
+		# Shared memory is fastest when it is backed by a file in memory
+		shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+		fd, path = tempfile.mkstemp(prefix="media_player_gst_", dir=shm_dir)
+		os.close(fd)
+		ring = frame_ring(path, slots, frame_bytes(*decoder.vidsize), lock, create=True)
+		conn.send(("ready", decoder.vidsize, decoder.fps, decoder.duration, path, decoder.quality_options()))
+
+		while True:
+			if conn.poll(0.005):
+				command = conn.recv()
+				try:
+					if command[0] == "play":
+						decoder.play()
+					elif command[0] == "pause":
+						decoder.pause()
+					elif command[0] == "rate":
+						decoder.set_rate(command[1])
+						conn.send(("rate",))
+					elif command[0] == "rewind":
+						decoder.rewind()
+						conn.send(("rewind",))
+					elif command[0] == "position":
+						conn.send(("position", decoder.position()))
+					elif command[0] == "stats":
+						conn.send(("stats", decoder.buffer_stats()))
+					elif command[0] == "audio_stats":
+						conn.send(("audio_stats", decoder.audio_stats()))
+					elif command[0] == "reset_stats":
+						decoder.reset_buffer_stats()
+					elif command[0] == "quality":
+						decoder.set_quality_option(command[1], command[2])
+					elif command[0] == "cpu":
+						user, system = os.times()[:2]
+						conn.send(("cpu", user + system))
+					elif command[0] == "stop":
+						break
+				except osexception as e:
+					conn.send(("failed", unicode(e)))
+
+			message = decoder.pop_message()
+			if not message is None:
+				conn.send(message)
+	except (EOFError, IOError):
+		# The main process has gone, so there is nobody left to decode for
+		pass
+	finally:
+		decoder.close()
+		if not ring is None:
+			ring.close()
+
+
+class decoder_process(frame_source):
+	"""
+	Decodes a video in a separate process, so that decoding and the playback loop do not compete
+	for the GIL. The frames are passed through a frame_ring in shared memory and commands over a pipe.
+	Offers the same methods as gst_decoder, so that media_player_gst can use either of them.
+	"""
+
+	def __init__(self, src, frame_callback, mute = False, buffering = None, buffer_duration = 0, buffer_prefill = 100, audio = None, slots = 3):
+		"""
+		Constructor. Starts the decoder process and waits until it has loaded the video.
+
+		Arguments:
+		src -- the path to the video file
+		frame_callback -- function that is called with the frame (an array in shared memory), its timestamp (in ns),
+			whether it is on time and the number of frames decoded so far, for each new frame
+
+		Keyword arguments:
+		mute -- mute the audio (default = False)
+		buffering -- a (budget, use_mmap) tuple for a readahead_reader, or None to not read ahead (default = None)
+		buffer_duration -- the minimum amount of video to read ahead in seconds (default = 0)
+		buffer_prefill -- the percentage of the read-ahead buffer to fill before playback (default = 100)
+		audio -- a dict with the keyword arguments for make_audio_sink(), or None to use playbin2's default sink (default = None)
+		slots -- the number of slots in the frame ring (default = 3)
+		"""
+		self.frame_callback = frame_callback
+		self.messages = collections.deque()	# Messages received while waiting for a reply
+		self.ring = None
+		self.rate = 1.0
+		self.last_seq = -1
+
+		# On Windows the process imports this module again, so it should be able to find it
+		plugin_folder = os.path.dirname(os.path.abspath(__file__))
+		if not plugin_folder in sys.path:
+			sys.path.append(plugin_folder)
+
+		self.conn, child_conn = multiprocessing.Pipe()
+		self.lock = multiprocessing.Lock()
+		self.process = multiprocessing.Process(target=decoder_process_main, args=(child_conn,
+			self.lock, src, mute, buffering, buffer_duration, buffer_prefill, audio, slots))
+		self.process.daemon = True
+		try:
+			self.process.start()
+		except AssertionError as e:
+			# E.g. when the experiment itself runs in a daemonic process
+			raise osexception(u"Could not start the decoder process: %s" % e)
+
+		# Loading includes filling the read-ahead buffer
+		reply = self.__request(None, "ready", BUFFER_PREFILL_TIMEOUT + DECODER_REPLY_TIMEOUT)
+		self.vidsize, self.fps, self.duration, self.ring_path, self._quality_options = reply[1:]
+		self.ring = frame_ring(self.ring_path, slots, frame_bytes(*self.vidsize), self.lock)
+
+	def __receive(self, timeout):
+		"""
+		Receives a message from the decoder process
+
+		Arguments:
+		timeout -- the maximum time to wait for a message in seconds
+
+		Returns:
+		The message, or None if there was none
+		"""
+		try:
+			if self.conn.poll(timeout):
+				return self.conn.recv()
+		except (EOFError, IOError):
+			pass
+		if not self.process.is_alive():
+			return ("error", u"The decoder process exited unexpectedly (exit code %s)" % self.process.exitcode, "")
+		return None
+
+	def __send(self, command):
+		"""
+		Sends a command to the decoder process
+
+		Arguments:
+		command -- the command tuple
+		"""
+		try:
+			self.conn.send(command)
+		except (EOFError, IOError):
+			# The pipe breaks when the decoder process has died
+			self.close()
+			raise osexception(u"Decoder process: The decoder process exited unexpectedly (exit code %s)" % self.process.exitcode)
+
+	def __request(self, command, reply, timeout = DECODER_REPLY_TIMEOUT):
+		"""
+		Sends a command to the decoder process and waits for its reply
+
+		Arguments:
+		command -- the command tuple, or None to only wait
+		reply -- the first element of the expected reply
+
+		Keyword arguments:
+		timeout -- the maximum time to wait for the reply in seconds (default = DECODER_REPLY_TIMEOUT)
+
+		Returns:
+		The reply tuple
+		"""
+		if not command is None:
+			self.__send(command)
+		deadline = default_timer() + timeout
+		while True:
+			message = self.__receive(1.0)
+			if not message is None:
+				if message[0] == reply:
+					return message
+				if message[0] == "failed" or (message[0] == "error" and (reply == "ready" or not self.process.is_alive())):
+					self.close()
+					raise osexception(u"Decoder process: %s" % message[1])
+				self.messages.append(message)
+			# A process that is alive but does not reply (e.g. stuck in a seek) would hang the experiment
+			if default_timer() > deadline:
+				self.close()
+				raise osexception(u"Decoder process: no reply within %d seconds" % timeout)
+
+	def play(self):
+		"""Starts or resumes playback"""
+		self.__send(("play",))
+
+	def pause(self):
+		"""Pauses playback"""
+		self.__send(("pause",))
+
+	def poll(self):
+		"""Passes the most recent frame to the frame callback, if a new one has been decoded"""
+		result = self.ring.read(self.last_seq)
+		if not result is None:
+			self.last_seq, pts, decoded, frame = result
+			self.frame_callback(frame, pts, True, decoded)
+
+	def position(self):
+		"""
+		Returns:
+		The current playback position in ns
+		"""
+		return self.__request(("position",), "position")[1]
+
+	def set_rate(self, rate):
+		"""
+		Changes the playback rate from the current position onwards
+
+		Arguments:
+		rate -- the new playback rate
+		"""
+		self.__request(("rate", rate), "rate")
+		self.rate = rate
+
+	def rewind(self):
+		"""
+		Seeks to the start of the video (or the end of it during reverse playback), keeping the current rate
+		"""
+		self.__request(("rewind",), "rewind")
+
+	def pop_message(self):
+		"""
+		Returns:
+		("eos",) at the end of the stream, ("error", message, debug_info) on errors
+		(including a crash of the decoder process) and None otherwise
+		"""
+		if self.messages:
+			return self.messages.popleft()
+		return self.__receive(0)
+
+	def buffer_stats(self):
+		"""
+		Returns:
+		A dict with the statistics of the read-ahead buffer, or None if the file is not read ahead
+		"""
+		return self.__request(("stats",), "stats")[1]
+
+	def reset_buffer_stats(self):
+		"""Resets the statistics of the read-ahead buffer (if any)"""
+		self.__send(("reset_stats",))
+
+	def quality_options(self):
+		"""
+		Returns:
+		The names of the options that the decoder of the video supports (see gst_decoder.set_quality_option())
+		"""
+		return self._quality_options
+
+	def cpu_time(self):
+		"""
+		Returns:
+		The CPU time in s that the decoder process has used
+		"""
+		return self.__request(("cpu",), "cpu")[1]
+
+	def set_quality_option(self, name, enabled):
+		"""
+		Enables or disables an option that lowers the cost of decoding (see gst_decoder.set_quality_option())
+
+		Arguments:
+		name -- the name of the option
+		enabled -- whether the option should be enabled
+		"""
+		self.__send(("quality", name, enabled))
+
+	def audio_stats(self):
+		"""
+		Returns:
+		A dict with the audio latencies and onset (see gst_decoder.audio_stats())
+		"""
+		return self.__request(("audio_stats",), "audio_stats")[1]
+
+	def close(self):
+		"""Stops the decoder process and frees the shared memory"""
+		if self.process.is_alive():
+			try:
+				self.conn.send(("stop",))
+			except IOError:
+				pass
+			self.process.join(5)
+			if self.process.is_alive():
+				self.process.terminate()
+		if not self.ring is None:
+			self.ring.close()
+			self.ring = None
+			os.remove(self.ring_path)
+
+class clocked_source(frame_source):
+	"""
+	Superclass of sources that have all frames available without GStreamer. The playback position
+	is kept with a timer, and on each poll() the frame belonging to the current position is passed on.
+	Frames that are late (because the player loop was too slow) are skipped, just as GStreamer does.
+	"""
+
+	def __init__(self, frame_callback, n_frames, fps):
+		"""
+		Constructor.
+
+		Arguments:
+		frame_callback -- function that is called with the frame, its timestamp (in ns),
+			whether it is on time and the number of frames passed so far, for each new frame
+		n_frames -- the number of frames
+		fps -- the frame rate at which the frames should be played
+		"""
+		if n_frames == 0:
+			raise osexception(u"There are no frames to play")
+		if fps <= 0:
+			raise osexception(u"The frame rate should be larger than 0")
+		self.frame_callback = frame_callback
+		self.n_frames = n_frames
+		self.fps = fps
+		self.duration = int(n_frames * gst.SECOND / fps)
+		self.rate = 1.0
+		self.frame_no = 0
+		self.messages = collections.deque()
+		self._position = 0.0		# Position in s at the time the timer was started
+		self._timer_start = None	# None while paused
+		self._last_index = None
+		self._ended = False
+
+	def __seconds(self):
+		"""
+		Returns:
+		The current position in seconds
+		"""
+		if self._timer_start is None:
+			return self._position
+		return self._position + (default_timer() - self._timer_start) * self.rate
+
+	def __restart(self, position):
+		"""
+		Continues from a new position
+
+		Arguments:
+		position -- the position in seconds
+		"""
+		self._position = position
+		if not self._timer_start is None:
+			self._timer_start = default_timer()
+
+	def get_frame(self, index):
+		"""
+		Should be implemented by subclasses
+
+		Arguments:
+		index -- the index of the frame
+
+		Returns:
+		The frame data (with rows padded to a multiple of 4 bytes, as gst does), or None if it is not available yet
+		"""
+		raise osexception(u"%s should implement get_frame()" % self.__class__.__name__)
+
+	def set_quality_option(self, name, enabled):
+		"""
+		Does nothing, as these sources offer no quality options (see quality_options())
+
+		Arguments:
+		name -- the name of the option
+		enabled -- whether the option should be enabled
+		"""
+		pass
+
+	def play(self):
+		"""Starts or resumes playback"""
+		if self._timer_start is None:
+			self._timer_start = default_timer()
+
+	def pause(self):
+		"""Pauses playback"""
+		if not self._timer_start is None:
+			self._position = self.__seconds()
+			self._timer_start = None
+
+	def poll(self):
+		"""Passes the frame belonging to the current position to the frame callback, if it has not been passed yet"""
+		if self._ended:
+			return
+		position = self.__seconds()
+		if position < 0 or position * self.fps >= self.n_frames:
+			self.messages.append(("eos",))
+			# Playback stays at the end until rewind() is called
+			self._ended = True
+			return
+
+		index = int(position * self.fps)
+		if index == self._last_index:
+			return
+		frame = self.get_frame(index)
+		# Keep showing the previous frame if this one has not been decoded in time
+		if frame is None:
+			return
+
+		if self._last_index is None:
+			self.frame_no += 1
+		else:
+			self.frame_no += abs(index - self._last_index)
+		self._last_index = index
+		self.frame_callback(frame, int(index * gst.SECOND / self.fps), True, self.frame_no)
+
+	def position(self):
+		"""
+		Returns:
+		The current playback position in ns
+		"""
+		if self._ended:
+			return self.duration if self.rate > 0 else 0
+		return int(self.__seconds() * gst.SECOND)
+
+	def set_rate(self, rate):
+		"""
+		Changes the playback rate from the current position onwards
+
+		Arguments:
+		rate -- the new playback rate
+		"""
+		if not self._ended:
+			self.__restart(self.__seconds())
+		self.rate = rate
+
+	def rewind(self):
+		"""
+		Seeks to the start (or the end during reverse playback), keeping the current rate
+		"""
+		self._ended = False
+		self._last_index = None
+		if self.rate > 0:
+			position = 0.0
+		else:
+			# Just before the end, so that the last frame is shown first
+			position = (self.n_frames - 0.5) / self.fps
+		self.__restart(position)
+
+	def pop_message(self):
+		"""
+		Returns:
+		("eos",) at the end of the frames and None otherwise
+		"""
+		if self.messages:
+			return self.messages.popleft()
+		return None
+
+
+class array_source(clocked_source):
+	"""
+	Plays frames from a numpy array in memory. If the rows of the frames already are a multiple
+	of 4 bytes long, the frames are passed to the handlers without being copied.
+	"""
+
+	def __init__(self, frames, frame_callback, fps):
+		"""
+		Constructor.
+
+		Arguments:
+		frames -- a (n, height, width, 3) array of RGB frames
+		frame_callback -- function that is called with each new frame (see clocked_source)
+		fps -- the frame rate at which the frames should be played
+		"""
+		frames = np.asarray(frames, dtype=np.uint8)
+		if frames.ndim != 4 or frames.shape[3] != 3:
+			raise osexception(u"Frames should be an array of shape (n, height, width, 3), not %s" % (frames.shape,))
+		n_frames, height, width = frames.shape[:3]
+		super(array_source, self).__init__(frame_callback, n_frames, fps)
+		self.vidsize = (width, height)
+
+		rowstride = frame_bytes(width, height) / height
+		if rowstride == width*3 and frames.flags.c_contiguous:
+			self.frames = frames.reshape(n_frames, -1)
+		else:
+			# Pad the rows (once) in the way the handlers expect them
+			padded = np.zeros((n_frames, height, rowstride), dtype=np.uint8)
+			padded[:, :, :width*3] = frames.reshape(n_frames, height, width*3)
+			self.frames = padded.reshape(n_frames, -1)
+
+	def get_frame(self, index):
+		"""
+		Arguments:
+		index -- the index of the frame
+
+		Returns:
+		The frame
+		"""
+		return self.frames[index]
+
+
+class image_sequence_source(clocked_source):
+	"""
+	Plays the images in a folder (in alphabetical order) as a video. A pool of threads decodes the
+	images ahead of the playback position, and keeps a limited number of decoded frames in a cache.
+	"""
+
+	# The file types that are played
+	IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tga", ".tif", ".tiff", ".gif")
+
+	def __init__(self, folder, frame_callback, fps, decode_ahead = 8, cache_size = 32, threads = None):
+		"""
+		Constructor. Returns once the first decode_ahead frames have been decoded.
+
+		Arguments:
+		folder -- the folder that contains the images
+		frame_callback -- function that is called with each new frame (see clocked_source)
+		fps -- the frame rate at which the images should be played
+
+		Keyword arguments:
+		decode_ahead -- the number of frames to decode ahead of the playback position (default = 8)
+		cache_size -- the maximum number of decoded frames to keep in memory (default = 32)
+		threads -- the number of decoding threads (default = None, one per processor core)
+		"""
+		self.paths = sorted(os.path.join(folder, filename) for filename in os.listdir(folder)
+			if os.path.splitext(filename)[1].lower() in self.IMAGE_EXTENSIONS)
+		super(image_sequence_source, self).__init__(frame_callback, len(self.paths), fps)
+
+		self.decode_ahead = decode_ahead
+		# Frames that are decoded ahead should not push each other out of the cache
+		self.cache_size = max(cache_size, decode_ahead + 1)
+		self.cache = collections.OrderedDict()	# Frame index -> result of the decoding thread
+		self.vidsize = pygame.image.load(self.paths[0]).get_size()
+		self.pool = multiprocessing.pool.ThreadPool(threads or multiprocessing.cpu_count())
+		self.reset_buffer_stats()
+
+		# Wait until the frames at the start have been decoded
+		self.__decode_ahead(0)
+		for index in range(min(decode_ahead, self.n_frames)):
+			self.cache[index].wait()
+
+	def __decode(self, index):
+		"""
+		Decodes an image. Runs in a decoding thread.
+
+		Arguments:
+		index -- the index of the frame
+
+		Returns:
+		The frame data
+		"""
+		surface = pygame.image.load(self.paths[index])
+		if surface.get_size() != self.vidsize:
+			raise osexception(u"Image '%s' is not of the same size as the first image" % self.paths[index])
+		width, height = self.vidsize
+		rows = np.frombuffer(pygame.image.tostring(surface, "RGB"), dtype=np.uint8).reshape(height, width*3)
+		rowstride = frame_bytes(width, height) / height
+		if rowstride != width*3:
+			rows = np.hstack((rows, np.zeros((height, rowstride - width*3), dtype=np.uint8)))
+		return rows.reshape(-1)
+
+	def __decode_ahead(self, index):
+		"""
+		Starts decoding the frames following (or, in reverse, preceding) a frame,
+		and removes the least recently used frames from the cache
+
+		Arguments:
+		index -- the index of the frame
+		"""
+		step = 1 if self.rate > 0 else -1
+		for i in range(index, index + step * (self.decode_ahead + 1), step):
+			if not 0 <= i < self.n_frames:
+				continue
+			# Mark the frames in the window as most recently used (starting with the current one),
+			# so that they are not removed below
+			if i in self.cache:
+				self.cache[i] = self.cache.pop(i)
+			else:
+				self.cache[i] = self.pool.apply_async(self.__decode, (i,))
+		while len(self.cache) > self.cache_size:
+			self.cache.popitem(last=False)
+
+	def get_frame(self, index):
+		"""
+		Arguments:
+		index -- the index of the frame
+
+		Returns:
+		The frame, or None if it has not been decoded yet
+		"""
+		self.__decode_ahead(index)
+
+		# Keep track of how many frames were ready ahead of the playback position
+		step = 1 if self.rate > 0 else -1
+		level = 0
+		for i in range(index + step, index + step * (self.decode_ahead + 1), step):
+			if i in self.cache and self.cache[i].ready():
+				level += 1
+		self.level_sum += level
+		self.level_count += 1
+		if self.min_level is None or level < self.min_level:
+			self.min_level = level
+
+		result = self.cache.get(index)
+		if result is None:
+			# Should not happen, but decode the frame again rather than fail during playback
+			result = self.cache[index] = self.pool.apply_async(self.__decode, (index,))
+		if not result.ready():
+			self.underruns += 1
+			return None
+		return result.get()
+
+	def buffer_stats(self):
+		"""
+		Returns:
+		A dict with the number of frames that were not decoded in time (underruns),
+		and the min_level, level_sum and level_count of the number of frames decoded ahead
+		"""
+		return {"underruns": self.underruns, "min_level": self.min_level,
+			"level_sum": self.level_sum, "level_count": self.level_count}
+
+	def reset_buffer_stats(self):
+		"""Resets the statistics of decoding ahead"""
+		self.underruns = 0
+		self.min_level = None
+		self.level_sum = 0
+		self.level_count = 0
+
+	def close(self):
+		"""Stops the decoding threads and frees the cache"""
+		self.pool.terminate()
+		self.pool.join()
+		self.cache.clear()
+
+
+#---------------------------------------------------------------------
+# Adaptive quality -- lowers the playback quality when frames are dropped
+#---------------------------------------------------------------------
+
+class quality_controller(object):
+	"""
+	Watches the percentage of dropped frames and the time it takes to draw a frame over a sliding
+	window. When either exceeds its budget, playback quality is lowered by one step, and when there
+	is ample headroom again for some time, the last step is undone. After each change, a full window
+	is waited for before the next decision, so that the effect of the change is measured.
+	"""
+
+	def __init__(self, steps, fps, window = 2.0, max_drops = 5.0, render_budget = 0.8):
+		"""
+		Constructor.
+
+		Arguments:
+		steps -- a list of (name, function) tuples of the steps by which quality can be lowered,
+			in the order in which they are taken. The function is called with True to take the step
+			and with False to undo it.
+		fps -- the frame rate of the video
+
+		Keyword arguments:
+		window -- the length of the sliding window in seconds (default = 2.0)
+		max_drops -- the percentage of frames that may be dropped (default = 5.0)
+		render_budget -- the part of the duration of a frame that drawing it may take (default = 0.8)
+		"""
+		self.steps = steps
+		self.fps = fps
+		self.window = window
+		self.max_drops = max_drops
+		self.render_budget = render_budget
+		self.level = 0			# The number of steps taken
+		self.events = []		# (time, frame, direction, step, drop percentage, render time in ms) of each change
+		self.samples = collections.deque()
+		self.render_time = 0.0
+		self.render_count = 0
+		self.start_time = None
+		self.last_change = None
+
+	def frame_drawn(self, render_time):
+		"""
+		Registers how long drawing a frame took
+
+		Arguments:
+		render_time -- the time it took in seconds
+		"""
+		self.render_time += render_time
+		self.render_count += 1
+
+	def update(self, now, decoded, shown, rate):
+		"""
+		Lowers or restores the quality if necessary. Called in every iteration of the player loop.
+
+		Arguments:
+		now -- the current time (from default_timer())
+		decoded -- the number of frames decoded so far
+		shown -- the number of frames shown so far
+		rate -- the current playback rate
+		"""
+		if self.start_time is None:
+			self.start_time = self.last_change = now
+		samples = self.samples
+		samples.append((now, decoded, shown, self.render_time, self.render_count))
+		while len(samples) > 1 and samples[1][0] <= now - self.window:
+			samples.popleft()
+		then, then_decoded, then_shown, then_render_time, then_render_count = samples[0]
+		if now - then < self.window or decoded - then_decoded < 2 or rate == 0:
+			# Not enough frames yet since the start or the last change (or playback is paused)
+			return
+
+		drops = max(0.0, 100.0 * (1 - 1.0 * (shown - then_shown) / (decoded - then_decoded)))
+		render_count = self.render_count - then_render_count
+		render_ms = 1000 * (self.render_time - then_render_time) / render_count if render_count else 0.0
+		budget_ms = 1000 * self.render_budget / (self.fps * abs(rate))
+
+		if (drops > self.max_drops or render_ms > budget_ms) and self.level < len(self.steps):
+			name, apply_step = self.steps[self.level]
+			apply_step(True)
+			self.level += 1
+			self.__changed(now, decoded, u"down", name, drops, render_ms)
+		elif drops <= self.max_drops / 5 and render_ms < budget_ms / 2 and self.level > 0 and \
+			now - self.last_change >= 2 * self.window:
+			# Only step up after a longer period of headroom, to prevent switching back and forth
+			self.level -= 1
+			name, apply_step = self.steps[self.level]
+			apply_step(False)
+			self.__changed(now, decoded, u"up", name, drops, render_ms)
+
+	def __changed(self, now, decoded, direction, name, drops, render_ms):
+		"""
+		Registers a change of quality and starts measuring anew
+
+		Arguments:
+		now -- the current time
+		decoded -- the number of frames decoded so far
+		direction -- "down" or "up"
+		name -- the name of the step
+		drops -- the percentage of dropped frames in the window
+		render_ms -- the mean time drawing a frame took in the window, in ms
+		"""
+		debug.msg(u"quality_controller: %s %s (%.1f%% dropped, %.2f ms drawing)" % (direction, name, drops, render_ms))
+		self.events.append((now - self.start_time, decoded, direction, name, drops, render_ms))
+		self.samples.clear()
+		self.last_change = now
+
+
+#---------------------------------------------------------------------
+# Main player class -- communicates with GStreamer
+#---------------------------------------------------------------------
+
+class media_player_gst(item.item, generic_response.generic_response):
+
+	"""The media_player plug-in offers advanced video playback functionality in OpenSesame using the GStreamer framework"""
+
+	def __init__(self, name, experiment, string = None):
+		"""
+		Constructor.
+
+		Arguments:
+		name -- the name of the item
+		experiment -- the opensesame experiment
+
+		Keyword arguments:
+		string -- a definition string for the item (Default = None)
+		"""
+
+		# The version of the plug-in
+		self.version = "1.0"
 
 		# GUI config options
 		self.item_type = u"media_player"
@@ -572,13 +2925,36 @@ class media_player_gst(item.item, generic_response.generic_response):
 		self.loop = u"no"
 		self.event_handler_trigger = u"on keypress"
 		self.event_handler = u""
+		self.playback_rate = 1.0
+		self.profile_trace = u""
+		self.decoding = u"in-process"
+		self.sequence_fps = 25
+		self.decode_ahead = 8
+		self.frame_cache = 32
+		self.audio_sink = u"autoaudiosink"
+		self.audio_buffer_time = 0
+		self.audio_latency_time = 0
+		self.buffering = u"none"
+		self.buffer_size = 32
+		self.buffer_duration = 0
+		self.buffer_prefill = 100
+		self.transcode = u"no"
+		self.transcode_fps = 0
+		self.transcode_cache = u""
+		self.transcode_cache_size = TRANSCODE_CACHE_SIZE
+		self.cues = u""
+		self.adaptive_quality = u"no"
+		self.adaptive_max_drops = 5
+		self.adaptive_window = 2
+
+		# Frames to play instead of a video file, which can be set from an inline_script
+		self.frame_array = None
+		# Function that trigger cues call with their value, which can be set from an inline_script
+		self.cue_callback = None
 
 		# The parent handles the rest of the construction
 		item.item.__init__(self, name, experiment, string)
 
-		# Indicate function for clean up that is run after the experiment finishes
-		self.experiment.cleanup_functions.append(self.close_streams)
-
 	def calculate_scaled_resolution(self, screen_res, image_res):
 		"""Calculate image size so it fits the screen
 		Arguments:
@@ -588,14 +2964,7 @@ class media_player_gst(item.item, generic_response.generic_response):
 		Returns:
 		(width, height) tuple of image scaled to window/screen
 		"""
-
-		rs = screen_res[0]/float(screen_res[1])
-		ri = image_res[0]/float(image_res[1])
-
-		if rs > ri:
-			return (int(image_res[0] * screen_res[1]/image_res[1]), screen_res[1])
-		else:
-			return (screen_res[0], int(image_res[1]*screen_res[0]/image_res[0]))
+		return fit_resolution(screen_res, image_res)
 
 	def prepare(self):
 		"""
@@ -608,12 +2977,17 @@ class media_player_gst(item.item, generic_response.generic_response):
 		# Pass the word on to the parent
 		item.item.prepare(self)
 
-		# Prepare GST loop
-		gobject.threads_init()
-		self.gst_loop = gobject.MainLoop()
+		# Indicate functions for clean up that are run after the experiment finishes. This is done here
+		# rather than in the constructor, because the GUI creates new items every time the script changes.
+		if not self.close_streams in self.experiment.cleanup_functions:
+			self.experiment.cleanup_functions.append(self.close_streams)
+		if not main_loop.shutdown in self.experiment.cleanup_functions:
+			self.experiment.cleanup_functions.append(main_loop.shutdown)
 
-		# Start gst loop (does internal gst event handling)
-		thread.start_new_thread(self.gst_loop.run, ())
+		# Free what is left of a previous run of this item
+		if not getattr(self, "decoder", None) is None:
+			self.decoder.close()
+		self.decoder = None
 
 		# class variables
 		self.frame_no = 0			# The no of the current frame
@@ -621,6 +2995,14 @@ class media_player_gst(item.item, generic_response.generic_response):
 		self.times_played = 1		# When in loop mode, this variable maintains the times looped
 		self.frame_on_time = True	# Init variable to be used later
 		self.frame_locked = False
+		self.rate = 1.0				# The current playback rate
+		self._first_video_pts = None	# Timestamp of the first frame that was shown
+		self._video_onset = None		# Wall time at which that frame was shown
+		self._shown_pts = None		# Timestamp of the frame that was shown with the last buffer swap
+		self.cue_log = []			# (definition, frame, flip-to-cue latency in s) of the cues performed
+		self._frames_shown = 0		# The number of different frames that have been shown
+		self._quality = None		# The quality_controller, if quality is adapted
+		self.overlay = overlay((self.experiment.width, self.experiment.height))
 
 		# Byte-compile the event handling code (if any)
 		if self.event_handler.strip() != "":
@@ -634,31 +3016,17 @@ class media_player_gst(item.item, generic_response.generic_response):
 		else:
 			self._event_handler_always = True
 
-		# Find the full path to the video file. This will point to some
-		# temporary folder where the file pool has been placed
-
-		# Temporary workaround to work with new OpenSesame 3 structure
-		try:
-			video_loc = self.eval_text(self.get("video_src"))
-		except AttributeError:
-			video_loc = self.syntax.eval_text(self.get("video_src"))
-
-		path = self.experiment.get_file(str(video_loc))
-
-		# Open the video file
-		if not os.path.exists(path) or str(video_loc).strip() == "":
-			raise osexception(u"Video file '%s' was not found in video_player '%s' (or no video file was specified)." % (os.path.basename(path), self.name))
-
-		debug.msg(u"media_player_gst.prepare(): loading '%s'" % path)
-
-		# Determine URI to file source
-		path = os.path.abspath(path)
-		path = urlparse.urljoin('file:', urllib.pathname2url(path))
-
-		debug.msg(u"transformed to URI '%s'" % path)
+		if not self.frame_array is None:
+			# Play frames that have been generated in memory
+			self.decoder = array_source(self.frame_array, self.__handle_videoframe, float(self.get("sequence_fps")))
+			self.__set_video_geometry()
+		else:
+			self.__open_file()
 
-		# Load video
-		self.load(path)
+		# Index the cues by frame number, which requires the frame rate of the video
+		self._cues = cue_table(self.get("cues"), self.fps)
+		if self._cues.has_action(u"trigger") and not callable(self.cue_callback):
+			raise osexception(u"The cues of '%s' contain trigger cues, but no cue_callback function has been set" % self.name)
 
 		# Set handler of frames and user input
 		if self.has("canvas_backend"):
@@ -688,72 +3056,105 @@ class media_player_gst(item.item, generic_response.generic_response):
 
 		return True
 
-	def load(self, vfile):
+	def __open_file(self):
 		"""
-		Loads a videofile and makes it ready for playback
-
-		Arguments:
-		vfile -- the path to the file to be played
+		Opens the video file or image folder set in video_src with the appropriate frame source
 		"""
+		# Find the full path to the video file. This will point to some
+		# temporary folder where the file pool has been placed
 
-		# Info required for color space conversion (YUV->RGB)
-		# masks are necessary for correct display on unix systems
-		self._VIDEO_CAPS = ','.join([
-		    'video/x-raw-rgb',
-		    'red_mask=(int)0xff0000',
-		    'green_mask=(int)0x00ff00',
-		    'blue_mask=(int)0x0000ff',
-		])
-		caps = gst.Caps(self._VIDEO_CAPS)
-
-		# Create videoplayer and load URI
-		self.player = gst.element_factory_make("playbin2", "player")
-		self.player.set_property("uri", vfile)
-
-		# Enable deinterlacing of video if necessary
-		self.player.props.flags |= (1 << 9)
-
-		# Reroute frame output to Python
-		self._videosink = gst.element_factory_make('appsink', 'videosink')
-		self._videosink.set_property('caps', caps)
-		self._videosink.set_property('async', True)
-		self._videosink.set_property('drop', True)
-		self._videosink.set_property('emit-signals', True)
+		# Temporary workaround to work with new OpenSesame 3 structure
+		try:
+			video_loc = self.eval_text(self.get("video_src"))
+		except AttributeError:
+			video_loc = self.syntax.eval_text(self.get("video_src"))
 
-		# Here the frame output is linked to our custom callback function
-		# which further processes the frame contents
-		self._videosink.connect('new-buffer', self.__handle_videoframe)
+		path = self.experiment.get_file(str(video_loc))
 
-		# Let the player output to our just created videosink
-		self.player.set_property('video-sink', self._videosink)
+		# Open the video file (or folder of images)
+		if not os.path.exists(path) or str(video_loc).strip() == "":
+			raise osexception(u"Video file '%s' was not found in video_player '%s' (or no video file was specified)." % (os.path.basename(path), self.name))
 
-		# Set functions for handling player messages
-		self.bus = self.player.get_bus()
-		self.bus.enable_sync_message_emission()
+		debug.msg(u"media_player_gst.prepare(): loading '%s'" % path)
 
-		# Preroll movie to get dimension data
-		self.player.set_state(gst.STATE_PAUSED)
+		if os.path.isdir(path):
+			# A folder of images is played as an image sequence
+			self.decoder = image_sequence_source(path, self.__handle_videoframe, float(self.get("sequence_fps")),
+				decode_ahead = int(self.get("decode_ahead")), cache_size = int(self.get("frame_cache")))
+			self.__set_video_geometry()
+			return
+
+		if self.transcode == u"yes":
+			# Play a version of the video that is cheap to decode (which is only transcoded the first time)
+			if self.fullscreen == u"yes":
+				bounds = (self.experiment.width, self.experiment.height)
+			else:
+				bounds = None
+			cache = transcode_cache(self.get("transcode_cache"), float(self.get("transcode_cache_size")),
+				bounds, int(self.get("transcode_fps")))
+			path = cache.get(path)
+			debug.msg(u"playing transcoded video '%s'" % path)
+
+		if self.buffering != u"none":
+			buffering = (int(float(self.get("buffer_size")) * 1024**2), self.buffering == u"memory map")
+		else:
+			buffering = None
+
+		if self.decoding == u"separate process":
+			# Load video in a decoder process, which reads the file itself
+			self.decoder = decoder_process(path, self.__handle_videoframe, mute = self.playaudio == u"no",
+				buffering = buffering, buffer_duration = float(self.get("buffer_duration")),
+				buffer_prefill = float(self.get("buffer_prefill")), audio = self.__audio_config())
+			self.__set_video_geometry()
+		else:
+			# When buffering, the file is read by a readahead_reader that playbin2
+			# pulls data from through an appsrc element
+			if not buffering is None:
+				readahead = readahead_reader(path, buffering[0], use_mmap = buffering[1])
+				path = u"appsrc://"
+			else:
+				readahead = None
+				# Determine URI to file source
+				path = file_uri(path)
+
+			debug.msg(u"transformed to URI '%s'" % path)
+
+			# Load video
+			self.load(path, readahead)
+
+	def load(self, vfile, readahead = None):
+		"""
+		Loads a videofile and makes it ready for playback
 
-		# If movie is loaded correctly, info about the clip should be available
-		if self.player.get_state(gst.CLOCK_TIME_NONE)[0] == gst.STATE_CHANGE_SUCCESS:
-			pads = self._videosink.pads()
-			for pad in pads:
-				caps = pad.get_negotiated_caps()[0]
-				for name in caps.keys():
-					debug.msg(u"{0}: {1}".format(name,caps[name]))
+		Arguments:
+		vfile -- the path to the file to be played
 
-				# Video dimensions
-				self.vidsize = caps['width'], caps['height']
-				# Frame rate
-				fps = caps["framerate"]
-				self.fps = (1.0*fps.num/fps.denom)
+		Keyword arguments:
+		readahead -- a readahead_reader that supplies the data if vfile is appsrc:// (default = None)
+		"""
+		self.decoder = gst_decoder(vfile, self.__handle_videoframe, mute = self.playaudio == u"no",
+			readahead = readahead, buffer_duration = float(self.get("buffer_duration")),
+			buffer_prefill = float(self.get("buffer_prefill")), audio = self.__audio_config())
+		self.player = self.decoder.player
+		self.__set_video_geometry()
 
+	def __audio_config(self):
+		"""
+		Returns:
+		The keyword arguments for make_audio_sink() as set in the item
+		"""
+		# Only the wav file sink writes to a file (next to the log file)
+		if self.audio_sink == u"wav file":
+			location = self.__output_path(u"%s_audio.wav" % self.name)
 		else:
-			raise osexception(u"Failed to open movie. Do you have all the necessary codecs/plugins installed?")
+			location = None
+		return {"name": self.audio_sink, "buffer_time": float(self.get("audio_buffer_time")),
+			"latency_time": float(self.get("audio_latency_time")), "location": location}
 
-		# Mute audio if necessary
-		if self.playaudio == u"no":
-			self.player.set_property("mute", True)
+	def __set_video_geometry(self):
+		"""Determines the size and position of the video on the screen once the decoder has loaded it"""
+		self.vidsize = self.decoder.vidsize
+		self.fps = self.decoder.fps
 
 		if self.fullscreen == u"yes":
 			# Calculate dimensions of video when scaled up to screen dimensions
@@ -766,31 +3167,28 @@ class media_player_gst(item.item, generic_response.generic_response):
 		self.vidPos = ((self.experiment.width - self.destsize[0]) / 2, (self.experiment.height - self.destsize[1]) / 2)
 		self.file_loaded = True
 
-	def __handle_videoframe(self, appsink):
+	def __handle_videoframe(self, frame, timestamp, on_time, frame_no):
 		"""
-		Callback function for GStreamer to pass the decoded videoframe to.
-		This function first checks if the frame is not lagging behind to much compared to the
-		player's internal timer and, if not, passes it on to the handler which draws the frame to the screen
+		Callback function for the decoder to pass the decoded videoframe to.
+		If the frame is not lagging behind too much compared to the player's internal timer,
+		it is passed on to the handler which draws the frame to the screen
 
 		Arguments
-		appsink 	-- the videosink element that sent the video frame
+		frame -- the frame data
+		timestamp -- the timestamp of the frame in ns
+		on_time -- False if the frame lags behind the player's internal timer
+		frame_no -- the number of frames decoded so far
 		"""
 		# Make sure frame is not accessed while being written (don't know if this matters)
 		self.frame_locked = True
 
-		# Get buffer from videosink
-		buffer = appsink.emit('pull-buffer')
-
-		# increment frame counter
-		self.frame_no += 1
-
-		# Check if the timestamp of the buffer is not too far behind on the internal clock of the player
-		# If computer is too slow for playing HD movies for instance, we need to drop frames 'manually'
-		self.frame_on_time = self.player.query_position(gst.FORMAT_TIME, None)[0] - buffer.timestamp < 10**8
+		self.frame_no = frame_no
+		self.frame_on_time = on_time
 
 		# Send frame buffer to handler if frame was on time
 		if self.frame_on_time:
-			self.handler.handle_videoframe(buffer.data)
+			with profiler.span("handle_videoframe"):
+				self.handler.handle_videoframe(frame, timestamp)
 
 		self.frame_locked = False
 
@@ -801,12 +3199,100 @@ class media_player_gst(item.item, generic_response.generic_response):
 		a call to this function will resume it
 		"""
 		if self.paused:
-			self.player.set_state(gst.STATE_PLAYING)
+			self.decoder.play()
 			self.paused = False
 		elif not self.paused:
-			self.player.set_state(gst.STATE_PAUSED)
+			self.decoder.pause()
 			self.paused = True
 
+	def set_rate(self, rate):
+		"""
+		Changes the playback rate from the current position onwards. A rate of 1.0 is normal playback,
+		2.0 plays at double speed, 0.5 at half speed and negative rates play the video in reverse.
+		Above a rate of TRICK_MODE_RATE (in either direction) only key frames are decoded, so that
+		decoding does not take more time at higher rates.
+
+		Arguments:
+		rate -- the new playback rate
+		"""
+		rate = float(rate)
+		if rate == 0:
+			raise osexception(u"A playback rate of 0 is not possible, use pause() instead")
+		if getattr(self, "playing", False):
+			self.__end_rate_segment()
+			self.decoder.set_rate(rate)
+			self.rate = rate
+			self.__start_rate_segment()
+		else:
+			self.decoder.set_rate(rate)
+			self.rate = rate
+
+	def rewind(self):
+		"""
+		Seeks to the start of the video (or the end of it during reverse playback), keeping the current rate
+		"""
+		self.decoder.rewind()
+		# Cues are performed again when the video is played again
+		self._cues.reset()
+
+	def __quality_steps(self):
+		"""
+		Returns:
+		The (name, function) tuples of the steps by which playback quality can be lowered (see quality_controller),
+		from the one that is least visible to the one that is most visible
+		"""
+		steps = []
+		if hasattr(self.handler, "set_fast_scaling"):
+			steps.append((u"fast_scaling", self.handler.set_fast_scaling))
+		for option in self.decoder.quality_options():
+			steps.append((option, lambda enabled, option = option: self.decoder.set_quality_option(option, enabled)))
+		return steps
+
+	def __perform_cues(self, flip_time):
+		"""
+		Performs the cues of the frames that have been passed since the previously shown frame
+
+		Arguments:
+		flip_time -- the time (from default_timer()) at which the frame was shown
+		"""
+		with profiler.span("cues"):
+			for frame, action, value, definition in self._cues.shown(self._shown_pts, self.rate):
+				latency = default_timer() - flip_time
+				if action == u"trigger":
+					self.cue_callback(value)
+				elif action == u"log":
+					debug.msg(u"cue at frame %d: %s" % (frame, value))
+					if self.sendInfoToEyelink == u"yes" and hasattr(self.experiment,"eyelink") and self.experiment.eyelink.connected():
+						self.experiment.eyelink.log(u"cue %s" % (value or frame))
+				elif action == u"pause":
+					if not self.paused:
+						self.pause()
+				elif action == u"stop":
+					self.playing = False
+				self.cue_log.append((definition, self._cues.frame_number(self._shown_pts), latency))
+
+	def __cpu_time(self):
+		"""
+		Returns:
+		The CPU time in s used by this process and, when decoding in a separate process, by the decoder process
+		"""
+		user, system = os.times()[:2]
+		return user + system + self.decoder.cpu_time()
+
+	def __start_rate_segment(self):
+		"""Starts collecting performance statistics for the current playback rate"""
+		self._segment = (self.rate, time.time(), self.__cpu_time(), self.frame_no, self._frames_shown)
+
+	def __end_rate_segment(self):
+		"""Adds the statistics collected since __start_rate_segment() to those of the rate they were collected at"""
+		rate, start_time, start_cpu, start_decoded, start_displayed = self._segment
+		stats = self.rate_stats.setdefault(rate, [0.0, 0.0, 0, 0])
+		stats[0] += time.time() - start_time
+		stats[1] += self.__cpu_time() - start_cpu
+		stats[2] += self.frame_no - start_decoded
+		# Count the different frames that were shown, not the redraws of the same frame
+		stats[3] += self._frames_shown - start_displayed
+
 	def run(self):
 		"""
 		Starts the playback of the video file. You can specify an optional callable object to handle events between frames (like keypresses)
@@ -825,31 +3311,77 @@ class media_player_gst(item.item, generic_response.generic_response):
 		self.experiment.response = None
 
 		if self.file_loaded:
+			# Write the timing of each stage of playback to a trace file
+			if self.profile_trace.strip() != "":
+				self._trace = chrome_trace(self.__trace_path())
+				profiler.add_consumer(self._trace)
+
+			# Only underruns during playback are of interest
+			self.decoder.reset_buffer_stats()
+
+			# Set the initial playback rate while the player is still prerolled
+			if float(self.get("playback_rate")) != 1.0:
+				self.set_rate(self.get("playback_rate"))
+				# Reverse playback starts at the end
+				if self.rate < 0:
+					self.rewind()
+
 			# Signal player to start video playback
-			self.player.set_state(gst.STATE_PLAYING)
+			self.decoder.play()
 
 			self.playing = True
 			self.paused = False
 
+			# Performance per playback rate: wall time, CPU time, frames decoded and displayed
+			self.rate_stats = {}
+			self.__start_rate_segment()
+
 			# Prepare frame renderer in handler for playback
 			# (e.g. set up OpenGL context, thus only relevant for OpenGL based backends)
 			self.handler.prepare_for_playback()
 
+			# Lower the quality when the computer cannot keep up
+			if self.adaptive_quality == u"yes":
+				self._quality = quality_controller(self.__quality_steps(), self.fps,
+					window = float(self.get("adaptive_window")), max_drops = float(self.get("adaptive_max_drops")))
+
 			### Main player loop. While True, the movie is playing
 			start_time = time.time()
 			while self.playing:
+				# Fetch a new frame if the decoder does not deliver them by itself
+				self.decoder.poll()
+
 				# Only draw frame to screen if timestamp is still within bounds of that of the player
 				# Just skip the drawing otherwise (and continue until a frame comes in that is in bounds again)
 				# self.frame_on_time = True
 				if self.frame_on_time and not self.frame_locked:
 					# Draw current frame to screen
-					self.handler.draw_frame()
+					render_start = default_timer()
+					with profiler.span("draw_frame"):
+						self.handler.draw_frame()
+					if not self._quality is None:
+						self._quality.frame_drawn(default_timer() - render_start)
 
-					# TODO: add section to let user optionally draw stuff on top of frame
-					# Best is to advise them to use the frame_no	 if they want to do this
+					# Users can draw on top of the frame with the overlay, which the handler composites in draw_frame()
 
 					# Swap buffers to show drawn stuff on screen
-					self.handler.swap_buffers()
+					with profiler.span("swap_buffers"):
+						self.handler.swap_buffers()
+
+					# Perform the cues of the frame right after it has been shown. The handler reports
+					# which frame it drew, as a newer one may have been decoded in the meantime.
+					drawn_pts = self.handler.drawn_pts
+					if drawn_pts != self._shown_pts:
+						flip_time = default_timer()
+						self._shown_pts = drawn_pts
+						self._frames_shown += 1
+						if len(self._cues) and not drawn_pts is None:
+							self.__perform_cues(flip_time)
+						# The onset of the video, to compare with that of the sound, is taken
+						# from the first frame that was drawn (not the black start texture)
+						if self._video_onset is None and not drawn_pts is None:
+							self._video_onset = time.time()
+							self._first_video_pts = drawn_pts
 
 					# Increase counter of frames displayed, to calculate real FPS at end of playback
 					self.frames_displayed += 1
@@ -857,14 +3389,20 @@ class media_player_gst(item.item, generic_response.generic_response):
 				if not self.paused:
 					# If connected to EyeLink and indicated that frame info should be sent.
 					if self.sendInfoToEyelink == u"yes" and hasattr(self.experiment,"eyelink") and self.experiment.eyelink.connected():
-						self.experiment.eyelink.log(u"videoframe %s" % self.frame_no)
-						self.experiment.eyelink.status_msg(u"videoframe %s" % self.frame_no )
+						with profiler.span("eyelink"):
+							self.experiment.eyelink.log(u"videoframe %s" % self.frame_no)
+							self.experiment.eyelink.status_msg(u"videoframe %s" % self.frame_no )
 
 				# Handle input events
-				if self._event_handler_always:
-					self.playing = self.handler.process_user_input_customized()
-				elif not self._event_handler_always:
-					self.playing = self.handler.process_user_input()
+				with profiler.span("process_user_input"):
+					if self._event_handler_always:
+						self.playing = self.handler.process_user_input_customized()
+					elif not self._event_handler_always:
+						self.playing = self.handler.process_user_input()
+
+				# Lower or restore the quality based on how well playback keeps up
+				if not self._quality is None and not self.paused:
+					self._quality.update(default_timer(), self.frame_no, self._frames_shown, self.rate)
 
 				# Determine if playback should continue when a time limit is set
 				if type(self.duration) == int:
@@ -872,33 +3410,33 @@ class media_player_gst(item.item, generic_response.generic_response):
 						self.playing = False
 
 				# Check for GST events: End of stream and errors
-				# Strangely, pop() is the only method that does not make gstreamer
-				# crash in multiprocessing mode under Ubuntu
-				event = self.bus.pop()
+				with profiler.span("bus"):
+					event = self.decoder.pop_message()
 				if event:
 					# End of stream event
-					if event.type == gst.MESSAGE_EOS:
+					if event[0] == "eos":
 						# If in loop mode, seek to the beginning of the movie again and keep playing
 						if self.loop == "yes":
-							self.player.seek_simple(gst.FORMAT_TIME, gst.SEEK_FLAG_FLUSH, 1.0)
+							self.rewind()
 							self.times_played += 1
 						else:
 							# Stop the player
 							self.playing = False
 					# On error print and quit
-					elif event.type == gst.MESSAGE_ERROR:
-						err, debug_info = event.parse_error()
+					elif event[0] == "error":
+						err, debug_info = event[1:]
 						print u"Gst Error: %s" % err, debug_info
 						self.close_streams()
 						raise osexception(u"Gst Error: %s" % err, debug_info)
 
-				# If gst loop is not running stop playback
-				if not self.gst_loop.is_running():
-					self.playing = False
+			self.__end_rate_segment()
 
 			# Restore OpenGL context as before playback
 			self.handler.playback_finished()
 
+			buffer_stats = self.decoder.buffer_stats()
+			audio_stats = self.decoder.audio_stats()
+
 			# Clean up resources
 			self.close_streams()
 
@@ -907,6 +3445,75 @@ class media_player_gst(item.item, generic_response.generic_response):
 			real_fps =  self.fps * fps_prop
 			debug.msg(u"Movie displayed with {0} fps ({1}% of intended {2} fps)".format(round(real_fps,2), int(fps_prop*100), round(self.fps,2)))
 
+			# Register the achieved frame rate and decoding load (CPU time / wall time) for each playback rate
+			rate_log = []
+			for rate in sorted(self.rate_stats):
+				duration, cpu_time, decoded, displayed = self.rate_stats[rate]
+				if duration <= 0:
+					continue
+				rate_log.append(u"rate={0},fps={1},decoded_fps={2},load={3}".format(rate,
+					round(displayed/duration,2), round(decoded/duration,2), round(cpu_time/duration,2)))
+				debug.msg(u"At rate {0}: {1} fps displayed, {2} fps decoded, decoding load {3}".format(rate,
+					round(displayed/duration,2), round(decoded/duration,2), round(cpu_time/duration,2)))
+			self.set_trial_var(u"rate_stats", u";".join(rate_log))
+
+			# All variables are set on every trial, as variables keep their value from the previous trial
+			# otherwise. Those that do not apply to this trial are set to NA (or empty for lists).
+
+			# Register how much time drawing the overlay took
+			if self.overlay.composite_count:
+				self.set_trial_var(u"overlay_ms", round(1000 * self.overlay.composite_time / self.overlay.composite_count, 3))
+			else:
+				self.set_trial_var(u"overlay_ms", u"NA")
+			self.set_trial_var(u"overlay_rasterized", self.overlay.rasterize_count)
+
+			# Register which cues were performed, at which frame and how long after the frame was shown
+			self.set_trial_var(u"cues", u";".join([u"%s@%d:%.3f" % (definition, frame, latency * 1000)
+				for definition, frame, latency in self.cue_log]))
+			if self.cue_log:
+				latencies = [latency * 1000 for definition, frame, latency in self.cue_log]
+				self.set_trial_var(u"cue_latency_mean", round(sum(latencies) / len(latencies), 3))
+				self.set_trial_var(u"cue_latency_max", round(max(latencies), 3))
+			else:
+				self.set_trial_var(u"cue_latency_mean", u"NA")
+				self.set_trial_var(u"cue_latency_max", u"NA")
+
+			# Register when and why the quality was lowered or restored
+			if not self._quality is None:
+				self.set_trial_var(u"adaptations", u";".join([u"%.2f:%d:%s:%s:drops=%.1f:render=%.2f" % adaptation
+					for adaptation in self._quality.events]))
+				self.set_trial_var(u"quality_level", self._quality.level)
+			else:
+				self.set_trial_var(u"adaptations", u"")
+				self.set_trial_var(u"quality_level", u"NA")
+
+			# Register the audio latency and how much later the sound started than the video
+			if not audio_stats["latency"] is None:
+				self.set_trial_var(u"audio_latency", 1.0*(audio_stats["latency"] + (audio_stats["device_latency"] or 0))/gst.MSECOND)
+			else:
+				self.set_trial_var(u"audio_latency", u"NA")
+			if not audio_stats["onset"] is None and not self._video_onset is None:
+				# Correct for a difference in timestamps of the first sound and the first frame
+				av_offset = (audio_stats["onset"] - 1.0*audio_stats["pts"]/gst.SECOND) - \
+					(self._video_onset - 1.0*self._first_video_pts/gst.SECOND)
+				self.set_trial_var(u"av_offset", round(av_offset * 1000, 2))
+				debug.msg(u"Sound started {0} ms after the video".format(round(av_offset * 1000, 2)))
+			else:
+				self.set_trial_var(u"av_offset", u"NA")
+
+			# Register how well the read-ahead buffer kept up
+			if not buffer_stats is None:
+				self.set_trial_var(u"buffer_underruns", buffer_stats["underruns"])
+				self.set_trial_var(u"buffer_level_min", buffer_stats["min_level"])
+				if buffer_stats["level_count"]:
+					self.set_trial_var(u"buffer_level_mean", buffer_stats["level_sum"] / buffer_stats["level_count"])
+				else:
+					self.set_trial_var(u"buffer_level_mean", u"NA")
+				debug.msg(u"Read-ahead buffer: {0} underruns, minimum level {1} bytes".format(buffer_stats["underruns"], buffer_stats["min_level"]))
+			else:
+				for var in (u"buffer_underruns", u"buffer_level_min", u"buffer_level_mean"):
+					self.set_trial_var(var, u"NA")
+
 			# Do some OpenSesame bookkeeping concerning responses
 			generic_response.generic_response.response_bookkeeping(self)
 			return True
@@ -921,19 +3528,807 @@ class media_player_gst(item.item, generic_response.generic_response):
 		Returns:
 		True on success
 		"""
-		if self.gst_loop.is_running():
-			# Free resources claimed by gstreamer
-			self.player.set_state(gst.STATE_NULL)
-			# Quit the player's main event loop
-			self.gst_loop.quit()
-
+		# Free resources claimed by gstreamer (the decoder stops the shared main loop
+		# once no other pipelines use it)
+		if not getattr(self, "decoder", None) is None:
+			self.decoder.close()
+			self.decoder = None
+
+		# Stop profiling and save what has been traced (also when playback was aborted)
+		if getattr(self, "_trace", None) is not None:
+			profiler.remove_consumer(self._trace)
+			self._trace.save()
+			self._trace = None
 
 		return True
 
+	def __trace_path(self):
+		"""
+		Returns:
+		The path of the file to write the profile trace to
+		"""
+		# Temporary workaround to work with new OpenSesame 3 structure
+		try:
+			path = self.eval_text(self.get("profile_trace"))
+		except AttributeError:
+			path = self.syntax.eval_text(self.get("profile_trace"))
+		return self.__output_path(path)
+
+	def __output_path(self, path):
+		"""
+		Arguments:
+		path -- the path of a file the item writes to
+
+		Returns:
+		The absolute path. Relative paths are relative to the log file.
+		"""
+		if not os.path.isabs(path):
+			path = os.path.join(os.path.dirname(os.path.abspath(self.experiment.logfile)), path)
+		return path
+
+	def set_trial_var(self, var, value):
+		"""
+		Sets an experimental variable named [var]_[item name], so that it is logged with the trial data
+
+		Arguments:
+		var -- the name of the variable (without the item name)
+		value -- the value of the variable
+		"""
+		# OS3 compatibility
+		try:
+			self.experiment.var.set(u"%s_%s" % (var, self.name), value)
+		except AttributeError:
+			self.experiment.set(u"%s_%s" % (var, self.name), value)
+
 	def var_info(self):
 		return generic_response.generic_response.var_info(self)
 
 
+#---------------------------------------------------------------------
+# Offline frame analysis -- decodes videos without displaying them
+#---------------------------------------------------------------------
+
+# Rec. 709 weights to compute luminance from RGB values
+LUMINANCE_WEIGHTS = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+def iter_frames(src, size=None, stride=1, queue_size=4):
+	"""
+	Generator that decodes a video and yields its frames as numpy arrays. The video is
+	decoded as fast as possible (i.e. not synced to a clock) and no display is required.
+	At most queue_size decoded frames are kept in memory: if they are not consumed,
+	decoding is blocked until they are, so memory use does not depend on the length of the video.
+
+	Arguments:
+	src -- the path to or the URI of the video file
+
+	Keyword arguments:
+	size -- (width, height) tuple to which frames should be scaled by gst.
+		Frames are delivered at their original size if None (default)
+	stride -- only yield every stride-th frame (default = 1, i.e. every frame)
+	queue_size -- the maximum number of decoded frames that are buffered (default = 4)
+
+	Yields:
+	(pts, frame) tuples, with pts the presentation timestamp of the frame in seconds and
+	frame a read-only (height, width, 3) uint8 array
+	"""
+	if not "://" in src and not src.startswith("file:"):
+		src = file_uri(src)
+
+	player = gst.element_factory_make("playbin2", "analyser")
+	player.set_property("uri", src)
+	# Only decode the video stream, audio and subtitles are of no interest here
+	player.props.flags = 1
+
+	videosink = gst.element_factory_make('appsink', 'analysissink')
+	videosink.set_property('caps', gst.Caps(video_caps(size)))
+	# Don't sync to the clock and block the decoder when the queue is full
+	videosink.set_property('sync', False)
+	videosink.set_property('drop', False)
+	videosink.set_property('max-buffers', queue_size)
+	player.set_property('video-sink', videosink)
+
+	# pull-buffer blocks forever if decoding fails halfway, so stop the pipeline
+	# (which unblocks it) as soon as an error is posted
+	errors = []
+	def on_error(bus, message):
+		errors.append(message.parse_error())
+		thread.start_new_thread(player.set_state, (gst.STATE_READY,))
+	bus = player.get_bus()
+	bus.enable_sync_message_emission()
+	bus.connect('sync-message::error', on_error)
+
+	try:
+		player.set_state(gst.STATE_PLAYING)
+		if player.get_state(gst.CLOCK_TIME_NONE)[0] == gst.STATE_CHANGE_FAILURE:
+			raise osexception(u"Failed to open movie. Do you have all the necessary codecs/plugins installed?")
+
+		frame_no = 0
+		while True:
+			buffer = videosink.emit('pull-buffer')
+			# None is returned at the end of the stream (or when the pipeline is stopped)
+			if buffer is None:
+				break
+			if frame_no % stride == 0:
+				structure = buffer.caps[0]
+				frame = frame_to_array(buffer.data, structure['width'], structure['height'])
+				yield 1.0*buffer.timestamp/gst.SECOND, frame
+			frame_no += 1
+
+		if errors:
+			err, debug_info = errors[0]
+			raise osexception(u"Gst Error: %s" % err, debug_info)
+	finally:
+		bus.disable_sync_message_emission()
+		player.set_state(gst.STATE_NULL)
+
+def iter_batches(frames, batch_size=32):
+	"""
+	Groups the frames yielded by iter_frames() in batches, so that statistics can be
+	calculated for many frames at once. The memory for a batch is allocated only once
+	and reused for each next batch, so copy a batch if you want to keep it around.
+
+	Arguments:
+	frames -- an iterable yielding (pts, frame) tuples, such as iter_frames()
+
+	Keyword arguments:
+	batch_size -- the (maximum) number of frames in a batch (default = 32)
+
+	Yields:
+	(pts, batch) tuples, with pts an (n,) array of timestamps and batch a (n, height, width, 3) uint8 array
+	"""
+	pts = np.zeros(batch_size)
+	batch = None
+	n = 0
+	for timestamp, frame in frames:
+		if batch is None:
+			batch = np.empty((batch_size,) + frame.shape, dtype=np.uint8)
+		pts[n] = timestamp
+		batch[n] = frame
+		n += 1
+		if n == batch_size:
+			yield pts, batch
+			n = 0
+	if n > 0:
+		yield pts[:n], batch[:n]
+
+def frame_luminance(batch):
+	"""
+	Arguments:
+	batch -- a (n, height, width, 3) array of RGB frames
+
+	Returns:
+	A (n, height, width) float32 array containing the luminance (0-255) of each pixel
+	"""
+	return batch.dot(LUMINANCE_WEIGHTS)
+
+def mean_luminance(batch):
+	"""
+	Arguments:
+	batch -- a (n, height, width, 3) array of RGB frames
+
+	Returns:
+	A (n,) array containing the mean luminance (0-255) of each frame
+	"""
+	return frame_luminance(batch).mean(axis=(1,2))
+
+def rms_contrast(batch):
+	"""
+	Arguments:
+	batch -- a (n, height, width, 3) array of RGB frames
+
+	Returns:
+	A (n,) array containing the RMS contrast (the standard deviation of the
+	luminance normalized to 0-1) of each frame
+	"""
+	return (frame_luminance(batch) / 255.0).std(axis=(1,2))
+
+def motion_energy(batch, previous=None):
+	"""
+	Calculates the motion energy of each frame as the mean absolute luminance difference
+	with the frame before it.
+
+	Arguments:
+	batch -- a (n, height, width, 3) array of RGB frames
+
+	Keyword arguments:
+	previous -- the (height, width, 3) frame preceding the first frame of the batch,
+		e.g. the last frame of the previous batch. The motion energy of the first frame
+		is 0 if None (default)
+
+	Returns:
+	A (n,) array containing the motion energy (0-255) of each frame
+	"""
+	luminance = frame_luminance(batch)
+	energy = np.zeros(len(batch))
+	if len(batch) > 1:
+		energy[1:] = np.abs(np.diff(luminance, axis=0)).mean(axis=(1,2))
+	if not previous is None:
+		energy[0] = np.abs(luminance[0] - frame_luminance(previous)).mean()
+	return energy
+
+def frame_statistics(src, size=None, stride=1, batch_size=32):
+	"""
+	Calculates the mean luminance, RMS contrast and motion energy of each frame in a video
+
+	Arguments:
+	src -- the path to or the URI of the video file
+
+	Keyword arguments:
+	size -- (width, height) tuple to which frames are scaled before analysis.
+		The original size is used if None (default)
+	stride -- only analyse every stride-th frame (default = 1)
+	batch_size -- the number of frames that are analysed at once (default = 32)
+
+	Returns:
+	A dict with the keys 'pts', 'luminance', 'contrast' and 'motion_energy', each containing
+	an array with one value per analysed frame
+	"""
+	stats = {'pts': [], 'luminance': [], 'contrast': [], 'motion_energy': []}
+	previous = None
+	for pts, batch in iter_batches(iter_frames(src, size, stride), batch_size):
+		stats['pts'].append(pts.copy())
+		stats['luminance'].append(mean_luminance(batch))
+		stats['contrast'].append(rms_contrast(batch))
+		stats['motion_energy'].append(motion_energy(batch, previous))
+		previous = batch[-1].copy()
+	for key in stats:
+		stats[key] = np.concatenate(stats[key]) if stats[key] else np.zeros(0)
+	return stats
+
+
+#---------------------------------------------------------------------
+# Transcoding cache -- converts videos to a format that is cheap to decode
+#---------------------------------------------------------------------
+
+# The default maximum size of the transcoding cache in MB
+TRANSCODE_CACHE_SIZE = 2048
+
+def transcode_video(src, dst, bounds=None, fps=0, quality=85):
+	"""
+	Transcodes a video to Motion JPEG in an AVI file, of which each frame is a
+	key frame that is cheap to decode (the sound is stored uncompressed).
+
+	Arguments:
+	src -- the path to the video
+	dst -- the path to the transcoded video
+
+	Keyword arguments:
+	bounds -- (width, height) tuple of the size to which the video is scaled (while maintaining
+		its aspect ratio), or None to keep its original size (default)
+	fps -- the fixed frame rate of the transcoded video, or 0 to keep the original frame rate (default)
+	quality -- the quality of the JPEG compression from 0 to 100 (default = 85)
+	"""
+	pipeline = gst.Pipeline("transcoder")
+	source = gst.element_factory_make("filesrc")
+	source.set_property("location", src)
+	decoder = gst.element_factory_make("decodebin2")
+	mux = gst.element_factory_make("avimux")
+	sink = gst.element_factory_make("filesink")
+	sink.set_property("location", dst)
+	pipeline.add(source, decoder, mux, sink)
+	source.link(decoder)
+	mux.link(sink)
+
+	linked = set()
+	def on_pad_added(element, pad):
+		structure = pad.get_caps()[0]
+		if structure.get_name().startswith("video/x-raw") and not "video" in linked:
+			caps = "video/x-raw-yuv,pixel-aspect-ratio=1/1"
+			if not bounds is None:
+				caps += ",width=%d,height=%d" % fit_resolution(bounds, (structure["width"], structure["height"]))
+			if fps > 0:
+				caps += ",framerate=%d/1" % fps
+			capsfilter = gst.element_factory_make("capsfilter")
+			capsfilter.set_property("caps", gst.Caps(caps))
+			encoder = gst.element_factory_make("jpegenc")
+			encoder.set_property("quality", quality)
+			branch = [gst.element_factory_make(name) for name in ("queue", "ffmpegcolorspace", "videoscale", "videorate")]
+			branch += [capsfilter, encoder]
+			linked.add("video")
+		elif structure.get_name().startswith("audio/x-raw") and not "audio" in linked:
+			capsfilter = gst.element_factory_make("capsfilter")
+			capsfilter.set_property("caps", gst.Caps("audio/x-raw-int,width=16,depth=16,signed=true"))
+			branch = [gst.element_factory_make(name) for name in ("queue", "audioconvert", "audioresample")]
+			branch += [capsfilter]
+			linked.add("audio")
+		else:
+			return
+		pipeline.add(*branch)
+		gst.element_link_many(*(branch + [mux]))
+		for element in branch:
+			element.sync_state_with_parent()
+		pad.link(branch[0].get_pad("sink"))
+	decoder.connect("pad-added", on_pad_added)
+
+	try:
+		pipeline.set_state(gst.STATE_PLAYING)
+		message = pipeline.get_bus().timed_pop_filtered(gst.CLOCK_TIME_NONE, gst.MESSAGE_EOS | gst.MESSAGE_ERROR)
+		if message.type == gst.MESSAGE_ERROR:
+			err, debug_info = message.parse_error()
+			raise osexception(u"Failed to transcode '%s': %s" % (src, err), debug_info)
+		if not "video" in linked:
+			raise osexception(u"Failed to transcode '%s': it does not contain a video stream" % src)
+	finally:
+		pipeline.set_state(gst.STATE_NULL)
+
+class transcode_cache(object):
+	"""
+	A directory of transcoded videos (see transcode_video()). The transcoded videos are stored
+	under a hash of the contents of the original video and the transcoding settings, so that
+	a video is only transcoded once, wherever it is stored. When the cache grows larger than
+	its maximum size, the least recently used videos are removed.
+	"""
+
+	# The content hashes of the videos for which a hash was computed, by (path, size, mtime)
+	_hashes = {}
+
+	def __init__(self, directory=None, max_size=TRANSCODE_CACHE_SIZE, bounds=None, fps=0, quality=85):
+		"""
+		Constructor.
+
+		Keyword arguments:
+		directory -- the cache directory, which is created if it does not exist
+			(default = media_player_gst_cache in the temporary folder)
+		max_size -- the maximum size of the cache in MB (default = 2048)
+		bounds -- (width, height) tuple of the size to which videos are scaled (while maintaining
+			their aspect ratio), or None to keep their original size (default)
+		fps -- the fixed frame rate of the transcoded videos, or 0 to keep the original frame rate (default)
+		quality -- the quality of the JPEG compression from 0 to 100 (default = 85)
+		"""
+		if not directory:
+			directory = os.path.join(tempfile.gettempdir(), u"media_player_gst_cache")
+		self.directory = directory
+		self.max_size = int(max_size * 1024**2)
+		self.bounds = bounds
+		self.fps = fps
+		self.quality = quality
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+	def content_hash(self, path):
+		"""
+		Arguments:
+		path -- the path to a video
+
+		Returns:
+		The SHA-1 hash of the contents of the video, as a hex string
+		"""
+		stat = os.stat(path)
+		key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+		if not key in self._hashes:
+			digest = hashlib.sha1()
+			with open(path, "rb") as f:
+				for chunk in iter(lambda: f.read(1024**2), b""):
+					digest.update(chunk)
+			self._hashes[key] = digest.hexdigest()
+		return self._hashes[key]
+
+	def cache_path(self, path):
+		"""
+		Arguments:
+		path -- the path to a video
+
+		Returns:
+		The path at which the transcoded video is stored in the cache
+		"""
+		settings = "%s-%s-%d" % ("%dx%d" % self.bounds if self.bounds else "original", self.fps, self.quality)
+		key = hashlib.sha1("%s:%s" % (self.content_hash(path), settings)).hexdigest()
+		return os.path.join(self.directory, key + ".avi")
+
+	def lookup(self, path):
+		"""
+		Arguments:
+		path -- the path to a video
+
+		Returns:
+		The path to the transcoded video if it is in the cache, or None otherwise
+		"""
+		cached = self.cache_path(path)
+		if not os.path.exists(cached):
+			return None
+		# The modification time marks when the video was last used, for evict()
+		os.utime(cached, None)
+		return cached
+
+	def get(self, path):
+		"""
+		Returns the transcoded video, and transcodes the video first if it is not in the cache
+
+		Arguments:
+		path -- the path to a video
+
+		Returns:
+		The path to the transcoded video
+		"""
+		cached = self.lookup(path)
+		if cached is None:
+			cached = self.transcode(path)
+			self.evict(keep = cached)
+		return cached
+
+	def transcode(self, path):
+		"""
+		Transcodes a video into the cache (without evicting other videos)
+
+		Arguments:
+		path -- the path to a video
+
+		Returns:
+		The path to the transcoded video
+		"""
+		cached = self.cache_path(path)
+		# Transcode to a temporary file first, so that a half-written video is never used
+		partial = u"%s.%d.part" % (cached, os.getpid())
+		debug.msg(u"media_player_gst: transcoding '%s' to '%s'" % (path, cached))
+		try:
+			with profiler.span("transcode"):
+				transcode_video(path, partial, self.bounds, self.fps, self.quality)
+			if os.path.exists(cached):
+				os.remove(cached)
+			os.rename(partial, cached)
+		finally:
+			if os.path.exists(partial):
+				os.remove(partial)
+		return cached
+
+	def evict(self, keep=None):
+		"""
+		Removes the least recently used videos until the cache is no larger than its maximum size
+
+		Keyword arguments:
+		keep -- the path to a video that should not be removed (default = None)
+		"""
+		entries = []
+		for name in os.listdir(self.directory):
+			if name.endswith(".avi"):
+				stat = os.stat(os.path.join(self.directory, name))
+				entries.append((stat.st_mtime, stat.st_size, os.path.join(self.directory, name)))
+		total = sum(entry[1] for entry in entries)
+		for mtime, size, path in sorted(entries):
+			if total <= self.max_size:
+				break
+			if not keep is None and os.path.abspath(path) == os.path.abspath(keep):
+				continue
+			try:
+				os.remove(path)
+				total -= size
+			except OSError:
+				# The video may be in use on Windows
+				debug.msg(u"media_player_gst: could not remove '%s' from the transcoding cache" % path)
+
+	def transcode_all(self, paths, processes=None):
+		"""
+		Transcodes the videos that are not in the cache yet in parallel worker processes
+
+		Arguments:
+		paths -- a list of paths to videos
+
+		Keyword arguments:
+		processes -- the number of worker processes (default = the number of CPUs)
+
+		Returns:
+		A list with a (path to the transcoded video, error message) tuple for each video,
+		in which the path is None if an error occurred and the error message None otherwise
+		"""
+		results = [(self.lookup(path), None) for path in paths]
+		todo = [i for i, (cached, error) in enumerate(results) if cached is None]
+		if todo:
+			pool = multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(todo)), gobject.threads_init)
+			try:
+				transcoded = pool.map(_transcode_worker, [(self, paths[i]) for i in todo], 1)
+			finally:
+				pool.close()
+				pool.join()
+			for i, result in zip(todo, transcoded):
+				results[i] = result
+			self.evict()
+		return results
+
+def _transcode_worker(args):
+	"""
+	Transcodes a video in a worker process of transcode_cache.transcode_all()
+
+	Arguments:
+	args -- a (cache, path) tuple
+
+	Returns:
+	A (path to the transcoded video, error message) tuple
+	"""
+	cache, path = args
+	try:
+		return cache.transcode(path), None
+	except Exception as e:
+		return None, unicode(e)
+
+
+#---------------------------------------------------------------------
+# Video pool validation -- checks beforehand whether videos can be played
+#---------------------------------------------------------------------
+
+# The extensions of the files that are checked in a directory or file pool
+VIDEO_EXTENSIONS = (".avi", ".mp4", ".m4v", ".mov", ".mkv", ".webm", ".ogv", ".ogg", ".mpg", ".mpeg", ".wmv", ".flv")
+
+# The default number of times faster than real time that a video should decode
+DECODE_HEADROOM = 1.5
+
+def find_videos(path, tmp_dir):
+	"""
+	Finds the videos to check in a video file, a directory (which is searched
+	recursively, so that the folder of an experiment includes its __pool__ folder)
+	or an experiment archive, of which the file pool is extracted to a new folder in tmp_dir.
+
+	Arguments:
+	path -- the path to a video, directory or .osexp/.opensesame.tar.gz file
+	tmp_dir -- the directory in which file pools are extracted
+
+	Returns:
+	A list of (name, path, error) tuples, with name the name to report for the video and
+	error a message if the video cannot be checked (in which case path is None), or None
+	"""
+	if not os.path.exists(path):
+		return [(path, None, u"File not found")]
+
+	if os.path.isdir(path):
+		videos = []
+		for dirpath, dirnames, filenames in os.walk(path):
+			dirnames.sort()
+			for filename in sorted(filenames):
+				if os.path.splitext(filename)[1].lower() in VIDEO_EXTENSIONS:
+					video = os.path.join(dirpath, filename)
+					videos.append((video, video, None))
+		return videos
+
+	if tarfile.is_tarfile(path):
+		videos = []
+		# Each archive gets its own folder, as the file pools of different experiments contain the same names
+		root = os.path.abspath(tempfile.mkdtemp(dir=tmp_dir))
+		archive = tarfile.open(path)
+		try:
+			for member in archive.getmembers():
+				folder = member.name.split("/")[0]
+				if not folder in ("pool", "__pool__") or os.path.splitext(member.name)[1].lower() not in VIDEO_EXTENSIONS:
+					continue
+				name = u"%s:%s" % (path, member.name)
+				# Never write outside of the folder, e.g. for members named pool/../../video.mp4
+				target = os.path.abspath(os.path.join(root, member.name))
+				if not member.isfile() or os.path.isabs(member.name) or not target.startswith(root + os.sep):
+					videos.append((name, None, u"Not a regular file inside the file pool"))
+					continue
+				archive.extract(member, root)
+				videos.append((name, target, None))
+		finally:
+			archive.close()
+		return videos
+
+	return [(path, path, None)]
+
+def check_video(path, size=None, headroom=DECODE_HEADROOM):
+	"""
+	Decodes a video as fast as possible, without displaying it, and determines whether
+	it decodes fast enough to be played in real time.
+
+	Arguments:
+	path -- the path to the video
+
+	Keyword arguments:
+	size -- (width, height) tuple of the size at which the video is displayed, or None to
+		decode it at its original size (default)
+	headroom -- how many times faster than real time the video should at least decode (default = 1.5)
+
+	Returns:
+	A dict with whether the video passed the check ("ok"), the number of decoded "frames",
+	the "duration" of the video and the "decode_time" in seconds, how many times faster than
+	real time it decoded ("speed"), the frame rate of the video ("fps") and the "error"
+	if it could not be decoded (or None)
+	"""
+	result = {"ok": False, "frames": 0, "duration": 0.0, "decode_time": 0.0, "speed": 0.0, "fps": 0.0, "error": None}
+	start = default_timer()
+	first_pts = pts = None
+	try:
+		for pts, frame in iter_frames(path, size):
+			if first_pts is None:
+				first_pts = pts
+			result["frames"] += 1
+	except Exception as e:
+		result["error"] = unicode(e)
+	result["decode_time"] = default_timer() - start
+
+	if result["frames"] > 1:
+		# The last frame is shown for one frame duration too
+		frame_duration = (pts - first_pts) / (result["frames"] - 1)
+		result["duration"] = pts - first_pts + frame_duration
+		result["fps"] = 1.0 / frame_duration if frame_duration > 0 else 0.0
+	if result["decode_time"] > 0:
+		result["speed"] = result["duration"] / result["decode_time"]
+
+	if result["error"] is None and result["frames"] == 0:
+		result["error"] = u"No frames could be decoded"
+	result["ok"] = result["error"] is None and result["speed"] >= headroom
+	return result
+
+def _failed_result(name, error):
+	"""
+	Arguments:
+	name -- the name of the video
+	error -- the reason why the video could not be checked
+
+	Returns:
+	A result like that of check_video() for a video that could not be checked
+	"""
+	return {"file": name, "ok": False, "frames": 0, "duration": 0.0,
+		"decode_time": 0.0, "speed": 0.0, "fps": 0.0, "error": error}
+
+def _check_video_worker(args):
+	"""
+	Checks a video in a worker process of validate_videos()
+
+	Arguments:
+	args -- a (name, path, size, headroom) tuple
+
+	Returns:
+	The result of check_video(), with the name of the video as "file"
+	"""
+	name, path, size, headroom = args
+	result = check_video(path, size, headroom)
+	result["file"] = name
+	return result
+
+def validate_videos(paths, size=None, headroom=DECODE_HEADROOM, processes=None, cache=None):
+	"""
+	Checks all videos in the given files, directories and experiments in parallel
+	worker processes (see check_video()). If a transcoding cache is given, the
+	videos are transcoded first (if they are not in the cache yet) and the
+	transcoded videos are checked.
+
+	Arguments:
+	paths -- a list of paths to videos, directories or experiment files
+
+	Keyword arguments:
+	size -- (width, height) tuple of the size at which the videos are displayed, or None to
+		decode them at their original size (default)
+	headroom -- how many times faster than real time the videos should at least decode (default = 1.5)
+	processes -- the number of worker processes (default = the number of CPUs)
+	cache -- a transcode_cache to transcode the videos with (default = None)
+
+	Returns:
+	A list with the result of check_video() for each video, with its name as "file"
+	"""
+	tmp_dir = tempfile.mkdtemp(prefix="media_player_gst_")
+	try:
+		jobs = []
+		failed = []
+		for path in paths:
+			for name, video, error in find_videos(path, tmp_dir):
+				if error is None:
+					jobs.append((name, video, size, headroom))
+				else:
+					failed.append(_failed_result(name, error))
+		if not jobs:
+			return failed
+
+		if not cache is None:
+			transcoded = cache.transcode_all([job[1] for job in jobs], processes)
+			original_jobs, jobs = jobs, []
+			for job, (cached, error) in zip(original_jobs, transcoded):
+				if error is None:
+					jobs.append((job[0], cached, size, headroom))
+				else:
+					failed.append(_failed_result(job[0], error))
+			if not jobs:
+				return failed
+
+		# Each process decodes a single video at a time, so that the measured speed
+		# is not lowered by the other videos more than it would be during an experiment
+		pool = multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(jobs)), gobject.threads_init)
+		try:
+			results = pool.map(_check_video_worker, jobs, 1)
+		finally:
+			pool.close()
+			pool.join()
+		return results + failed
+	finally:
+		shutil.rmtree(tmp_dir, True)
+
+def format_results(results):
+	"""
+	Arguments:
+	results -- the list that validate_videos() returns
+
+	Returns:
+	The results as a text table
+	"""
+	header = ("Result", "Speed", "FPS", "Frames", "Duration", "File")
+	rows = []
+	for result in results:
+		if not result["error"] is None:
+			status = "ERROR"
+		else:
+			status = "OK" if result["ok"] else "SLOW"
+		rows.append((status, "%.2fx" % result["speed"], "%.2f" % result["fps"], "%d" % result["frames"],
+			"%.1fs" % result["duration"], result["file"]))
+
+	widths = [max([len(header[i])] + [len(row[i]) for row in rows]) for i in range(len(header) - 1)]
+	lines = []
+	for row in [header] + rows:
+		lines.append(u"  ".join([row[i].ljust(widths[i]) for i in range(len(widths))] + [row[-1]]))
+	for result in results:
+		if not result["error"] is None:
+			lines.append(u"%s: %s" % (result["file"], result["error"]))
+	return u"\n".join(lines)
+
+def main(argv=None):
+	"""
+	The command line entry point, which checks whether videos can be decoded fast enough
+	(or, with --soak, whether playing them repeatedly leaks resources).
+	Run `python media_player_gst.py --help` for its usage.
+
+	Keyword arguments:
+	argv -- the command line arguments (default = sys.argv[1:])
+
+	Returns:
+	The exit status: 0 if all videos passed the check and 1 otherwise
+	"""
+	parser = argparse.ArgumentParser(description=u"Checks whether videos can be decoded fast enough "
+		u"for playback with the media_player_gst plugin.")
+	parser.add_argument("paths", nargs="*", metavar="PATH",
+		help=u"a video, a directory with videos or an experiment (.osexp or .opensesame.tar.gz) whose file pool is checked")
+	parser.add_argument("--size", metavar="WIDTHxHEIGHT",
+		help=u"the size at which the videos are displayed (default: their original size)")
+	parser.add_argument("--headroom", type=float, default=DECODE_HEADROOM,
+		help=u"how many times faster than real time videos should decode (default: %(default)s)")
+	parser.add_argument("--processes", type=int, default=None,
+		help=u"the number of worker processes (default: the number of CPUs)")
+	parser.add_argument("--json", metavar="FILE",
+		help=u"also write the results to FILE in JSON format ('-' for standard output, instead of the table)")
+	parser.add_argument("--transcode", action="store_true",
+		help=u"transcode the videos into the transcoding cache first (scaled to fit --size) and check the transcoded videos")
+	parser.add_argument("--cache", metavar="DIR", default=u"",
+		help=u"the transcoding cache directory (default: media_player_gst_cache in the temporary folder)")
+	parser.add_argument("--cache-size", type=float, default=TRANSCODE_CACHE_SIZE,
+		help=u"the maximum size of the transcoding cache in MB (default: %(default)s)")
+	parser.add_argument("--fps", type=int, default=0,
+		help=u"the frame rate of the transcoded videos (default: their original frame rate)")
+	parser.add_argument("--soak", type=int, metavar="CYCLES",
+		help=u"instead of checking the decoding speed, play each video CYCLES times in a row and check "
+			u"that the number of threads, open files and memory use do not grow")
+	parser.add_argument("--readahead-test", action="store_true",
+		help=u"instead of checking videos, test read-ahead buffering with a throttled test video")
+	args = parser.parse_args(argv)
+
+	# The diagnostics are kept in a separate module, as OpenSesame imports this one at startup.
+	# When this module is run as a script, they should use it rather than import it a second time.
+	if args.readahead_test or args.soak:
+		sys.modules.setdefault("media_player_gst", sys.modules[__name__])
+	if args.readahead_test:
+		import media_player_gst_diagnostics
+		return media_player_gst_diagnostics.run_readahead_test()
+	if not args.paths:
+		parser.error(u"no videos, directories or experiments given")
+	if args.soak:
+		import media_player_gst_diagnostics
+		return media_player_gst_diagnostics.run_soak(args.paths, args.soak)
+
+	size = None
+	if args.size:
+		try:
+			size = tuple(int(value) for value in args.size.lower().split("x"))
+		except ValueError:
+			size = ()
+		if len(size) != 2:
+			parser.error(u"--size should be given as WIDTHxHEIGHT, for instance 1024x768")
+
+	cache = transcode_cache(args.cache, args.cache_size, size, args.fps) if args.transcode else None
+	results = validate_videos(args.paths, size, args.headroom, args.processes, cache)
+	if args.json == "-":
+		print json.dumps(results, indent=2, sort_keys=True)
+	else:
+		print format_results(results) if results else u"No videos found"
+		if args.json:
+			with open(args.json, "w") as f:
+				json.dump(results, f, indent=2, sort_keys=True)
+	return 0 if results and all(result["ok"] for result in results) else 1
+
+
 #---------------------------------------------------------------------
 # GUI class
 #---------------------------------------------------------------------
@@ -968,3 +4363,7 @@ class qtmedia_player_gst(media_player_gst, qtautoplugin):
 		# event handler is called or not.
 		self.line_edit_duration.setEnabled( \
 			self.combobox_event_handler_trigger.currentIndex() == 0)
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,461 @@
+"""
+This file is part of OpenSesame.
+
+OpenSesame is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenSesame is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenSesame.  If not, see <http://www.gnu.org/licenses/>.
+
+Diagnostics for the media_player_gst plugin, which are kept out of the plugin module
+because OpenSesame imports that at startup. They test read-ahead buffering with a
+throttled file, and check whether playing videos many times in a row leaks threads,
+open files or memory. Run `python media_player_gst_diagnostics.py --help` for the usage
+(media_player_gst.py offers the same with its --readahead-test and --soak options).
+"""
+
+# General modules
+import os, sys
+import time
+import threading
+import argparse, tempfile, shutil
+import gc					# To measure memory use in the soak test
+from timeit import default_timer	# The most precise timer on each platform
+
+# The plugin module, which sets up GStreamer
+from media_player_gst import gst, debug, osexception, pygame, file_uri, find_videos, \
+	readahead_reader, gst_decoder, main_loop, main_loop_service, media_player_gst
+
+
+#---------------------------------------------------------------------
+# Read-ahead buffering
+#---------------------------------------------------------------------
+
+class throttled_file(object):
+	"""
+	A file that is read at a limited rate, to simulate slow (e.g. network mounted) storage
+	when testing a readahead_reader.
+	"""
+
+	def __init__(self, path, rate):
+		"""
+		Constructor.
+
+		Arguments:
+		path -- the path to the file
+		rate -- the maximum number of bytes read per second
+		"""
+		self.file = open(path, "rb")
+		self.rate = rate
+
+	def seek(self, offset):
+		"""
+		Arguments:
+		offset -- the position to read from next
+		"""
+		self.file.seek(offset)
+
+	def read(self, size):
+		"""
+		Reads data and waits as long as reading it at the limited rate would take
+
+		Arguments:
+		size -- the number of bytes to read
+
+		Returns:
+		The data
+		"""
+		data = self.file.read(size)
+		time.sleep(len(data) / float(self.rate))
+		return data
+
+	def fileno(self):
+		"""
+		Returns:
+		The file descriptor
+		"""
+		return self.file.fileno()
+
+	def close(self):
+		"""Closes the file"""
+		self.file.close()
+
+def make_test_video(path, seconds=4, size=(320, 240), fps=25):
+	"""
+	Writes a test video (Motion JPEG in an AVI file, without sound) with GStreamer's test pattern
+
+	Arguments:
+	path -- the path of the video file
+
+	Keyword arguments:
+	seconds -- the duration of the video (default = 4)
+	size -- (width, height) tuple of the size of the video (default = (320, 240))
+	fps -- the frame rate of the video (default = 25)
+	"""
+	pipeline = gst.parse_launch("videotestsrc num-buffers=%d ! capsfilter name=caps ! jpegenc ! avimux ! filesink name=sink" % (seconds * fps))
+	pipeline.get_by_name("caps").set_property("caps", gst.Caps("video/x-raw-yuv,width=%d,height=%d,framerate=%d/1" % (size[0], size[1], fps)))
+	pipeline.get_by_name("sink").set_property("location", path)
+	try:
+		pipeline.set_state(gst.STATE_PLAYING)
+		message = pipeline.get_bus().timed_pop_filtered(gst.CLOCK_TIME_NONE, gst.MESSAGE_EOS | gst.MESSAGE_ERROR)
+		if message.type == gst.MESSAGE_ERROR:
+			err, debug_info = message.parse_error()
+			raise osexception(u"Failed to write the test video: %s" % err, debug_info)
+	finally:
+		pipeline.set_state(gst.STATE_NULL)
+
+def _play_to_end(decoder, timeout):
+	"""
+	Plays a video until the end
+
+	Arguments:
+	decoder -- the gst_decoder that plays the video
+	timeout -- the maximum time to wait for the end of the video in seconds
+
+	Returns:
+	A description of the problem if the end was not reached, or None
+	"""
+	decoder.play()
+	deadline = default_timer() + timeout
+	while default_timer() < deadline:
+		message = decoder.pop_message()
+		if message is None:
+			time.sleep(0.01)
+		elif message[0] == "eos":
+			return None
+		elif message[0] == "error":
+			return message[1]
+	return u"the end of the video was not reached within %d seconds" % timeout
+
+def readahead_test(seconds=4, budget=0.5, fast=4.0, slow=0.5):
+	"""
+	Tests read-ahead buffering in a real pipeline: a test video is played through appsrc:// by a
+	gst_decoder, from a readahead_reader that reads it from a throttled_file. It checks that loading
+	waits for the buffer to fill, that no underruns occur when the file is read faster than it is played,
+	also after rewinding (as when a video is looped), and that underruns are counted when the file is
+	read more slowly than it is played.
+
+	Keyword arguments:
+	seconds -- the duration of the test video (default = 4)
+	budget -- the size of the read-ahead buffer as a fraction of the size of the video file (default = 0.5)
+	fast -- the rate at which the file is read when it should keep up, relative to its bitrate (default = 4.0)
+	slow -- the rate at which the file is read when it should not keep up, relative to its bitrate (default = 0.5)
+
+	Returns:
+	A dict with a list of the "problems" that were found and whether there were none ("ok")
+	"""
+	tmp_dir = tempfile.mkdtemp(prefix="media_player_gst_")
+	problems = []
+	frames = [0]
+	def on_frame(data, pts, on_time, frame_no):
+		frames[0] += 1
+	try:
+		path = os.path.join(tmp_dir, "test.avi")
+		make_test_video(path, seconds)
+		size = os.path.getsize(path)
+		bitrate = float(size) / seconds
+
+		# A file that is read faster than it is played
+		reader = readahead_reader(path, int(budget * size), file = throttled_file(path, fast * bitrate))
+		decoder = gst_decoder(u"appsrc://", on_frame, mute = True, readahead = reader)
+		try:
+			if reader.level < reader.budget and not reader.eof:
+				problems.append(u"loading finished with %d of %d bytes read ahead" % (reader.level, reader.budget))
+			decoder.reset_buffer_stats()
+			for attempt in (u"playback", u"playback after rewinding"):
+				if attempt != u"playback":
+					decoder.rewind()
+				frames[0] = 0
+				problem = _play_to_end(decoder, 2 * seconds + main_loop_service.TIMEOUT)
+				if not problem is None:
+					problems.append(u"%s: %s" % (attempt, problem))
+				if not frames[0]:
+					problems.append(u"%s: no frames were decoded" % attempt)
+				# Refilling the buffer after the seek is not an underrun
+				if reader.underruns:
+					problems.append(u"%s: %d underruns while the file is read %s times faster than it is played" % (attempt, reader.underruns, fast))
+		finally:
+			decoder.close()
+
+		# A file that is read more slowly than it is played
+		reader = readahead_reader(path, int(budget * size), file = throttled_file(path, slow * bitrate))
+		decoder = gst_decoder(u"appsrc://", on_frame, mute = True, readahead = reader, buffer_prefill = 0)
+		try:
+			decoder.reset_buffer_stats()
+			problem = _play_to_end(decoder, 2 * seconds / slow + main_loop_service.TIMEOUT)
+			if not problem is None:
+				problems.append(u"slow playback: %s" % problem)
+			if not reader.underruns:
+				problems.append(u"no underruns while the file is read %s times as fast as it is played" % slow)
+		finally:
+			decoder.close()
+	finally:
+		shutil.rmtree(tmp_dir, True)
+	return {"problems": problems, "ok": not problems}
+
+
+#---------------------------------------------------------------------
+# Soak testing -- checks that playback does not leak resources
+#---------------------------------------------------------------------
+
+def process_resources():
+	"""
+	Returns:
+	A dict with the number of "threads" and open file descriptors ("fds") of this process
+	and its resident memory ("rss", in bytes). The number of threads only includes Python
+	threads, and fds and rss are None, on systems without /proc.
+	"""
+	resources = {"threads": threading.active_count(), "fds": None, "rss": None}
+	if os.path.isdir("/proc/self/fd"):
+		with open("/proc/self/status") as f:
+			for line in f:
+				if line.startswith("Threads:"):
+					resources["threads"] = int(line.split()[1])
+				elif line.startswith("VmRSS:"):
+					resources["rss"] = int(line.split()[1]) * 1024
+		resources["fds"] = len(os.listdir("/proc/self/fd"))
+	return resources
+
+# The (decoding, buffering) settings with which item_soak_test() plays videos by default
+SOAK_VARIANTS = [(u"in-process", u"none"), (u"in-process", u"read-ahead"), (u"separate process", u"read-ahead")]
+
+def _leak_problems(baseline, final, max_rss_growth):
+	"""
+	Arguments:
+	baseline -- the process_resources() after the warm-up cycles of a soak test
+	final -- the process_resources() at the end of the soak test
+	max_rss_growth -- the growth of the resident memory in MB that is tolerated
+
+	Returns:
+	A list of descriptions of the resources that grew
+	"""
+	problems = []
+	if final["threads"] > baseline["threads"]:
+		problems.append(u"the number of threads grew from %d to %d" % (baseline["threads"], final["threads"]))
+	if not final["fds"] is None and final["fds"] > baseline["fds"]:
+		problems.append(u"the number of open files grew from %d to %d" % (baseline["fds"], final["fds"]))
+	if not final["rss"] is None and final["rss"] - baseline["rss"] > max_rss_growth * 1024**2:
+		problems.append(u"the resident memory grew from %.1f MB to %.1f MB" % (baseline["rss"] / 1024.0**2, final["rss"] / 1024.0**2))
+	if main_loop.owned() or main_loop.is_running():
+		problems.append(u"the main loop still runs after all pipelines were closed")
+	return problems
+
+def soak_test(src, cycles=1000, frames=5, warmup=20, max_rss_growth=16):
+	"""
+	Opens, plays and closes a video many times in a row with a bare gst_decoder, without displaying it,
+	to check that no threads, file descriptors or memory leak from one playback to the next. The resources
+	after the warm-up cycles (during which caches are filled) are compared with those at the end.
+	See item_soak_test() to do the same through the item, as an experiment would.
+
+	Arguments:
+	src -- the path to or the URI of the video file
+
+	Keyword arguments:
+	cycles -- the number of times the video is played (default = 1000)
+	frames -- the number of frames that is played each time (default = 5)
+	warmup -- the number of cycles after which the resources are measured for comparison (default = 20)
+	max_rss_growth -- the growth of the resident memory in MB that is tolerated (default = 16)
+
+	Returns:
+	A dict with the "baseline" and "final" process_resources(), the number of "cycles" and "errors",
+	a list of the "problems" that were found and whether there were none ("ok")
+	"""
+	if not "://" in src and not src.startswith("file:"):
+		src = file_uri(src)
+
+	baseline = None
+	errors = 0
+	for cycle in range(cycles):
+		received = [0]
+		def on_frame(data, pts, on_time, frame_no):
+			received[0] += 1
+		decoder = gst_decoder(src, on_frame, audio = {"name": u"fakesink"})
+		try:
+			decoder.play()
+			deadline = default_timer() + main_loop_service.TIMEOUT
+			while received[0] < frames and default_timer() < deadline:
+				message = decoder.pop_message()
+				if not message is None:
+					errors += message[0] == "error"
+					break
+				time.sleep(0.001)
+		finally:
+			decoder.close()
+		del decoder
+		if cycle == min(warmup, cycles) - 1:
+			gc.collect()
+			baseline = process_resources()
+
+	gc.collect()
+	final = process_resources()
+	problems = _leak_problems(baseline, final, max_rss_growth)
+	return {"baseline": baseline, "final": final, "cycles": cycles, "errors": errors, "problems": problems, "ok": not problems}
+
+def item_soak_test(src, cycles=1000, frames=5, decoding=u"in-process", buffering=u"none", warmup=20, max_rss_growth=16):
+	"""
+	Prepares, runs and closes a media_player_gst item many times in a row, as a loop in an experiment
+	would, to check that no threads, file descriptors or memory leak from one trial to the next. The
+	item is part of a minimal experiment with the legacy back-end, which draws to a display of SDL's
+	dummy video driver, so that no window is opened. At the end, the clean-up functions that the item
+	registered are run, as they are when an experiment finishes.
+
+	Arguments:
+	src -- the path to the video file
+
+	Keyword arguments:
+	cycles -- the number of times the item is run (default = 1000)
+	frames -- the number of frames that is played each time (default = 5)
+	decoding -- the decoding setting of the item: "in-process" or "separate process" (default = "in-process")
+	buffering -- the buffering setting of the item: "none", "read-ahead" or "memory map" (default = "none")
+	warmup -- the number of cycles after which the resources are measured for comparison (default = 20)
+	max_rss_growth -- the growth of the resident memory in MB that is tolerated (default = 16)
+
+	Returns:
+	A dict with the "baseline" and "final" process_resources(), the number of "cycles" and "errors",
+	a list of the "problems" that were found and whether there were none ("ok")
+	"""
+	from libopensesame.experiment import experiment
+
+	# Without a display (e.g. on a test server) SDL draws to memory
+	if not pygame.display.get_init():
+		os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+		pygame.display.init()
+	size = (320, 240)
+	tmp_dir = tempfile.mkdtemp(prefix="media_player_gst_soak_")
+	try:
+		exp = experiment(u"soak_test", u"set width %d\nset height %d\nset canvas_backend legacy\n" % size)
+		exp.surface = exp.window = pygame.display.set_mode(size)
+		exp.logfile = os.path.join(tmp_dir, u"soak_test.csv")
+		# Playback is stopped by the event handler after the given number of frames,
+		# or by the duration (in seconds) if no frames arrive
+		script = u"\n".join([u"set video_src \"%s\"" % os.path.abspath(src),
+			u"set duration %d" % main_loop_service.TIMEOUT,
+			u"set event_handler_trigger \"after every frame\"",
+			u"set event_handler \"continue_playback = frame < %d\"" % frames,
+			u"set decoding \"%s\"" % decoding, u"set buffering \"%s\"" % buffering,
+			u"set buffer_size 4", u"set audio_sink fakesink"])
+		player = media_player_gst(u"soak_test_player", exp, script)
+
+		baseline = None
+		cleanup_functions = None
+		errors = 0
+		for cycle in range(cycles):
+			try:
+				player.prepare()
+				player.run()
+			except osexception as e:
+				debug.msg(u"soak test: %s" % e)
+				errors += 1
+				player.close_streams()
+			if cleanup_functions is None:
+				cleanup_functions = len(exp.cleanup_functions)
+			if cycle == min(warmup, cycles) - 1:
+				gc.collect()
+				baseline = process_resources()
+
+		problems = []
+		if len(exp.cleanup_functions) != cleanup_functions:
+			problems.append(u"the number of clean-up functions grew from %d to %d" % (cleanup_functions, len(exp.cleanup_functions)))
+		for cleanup in exp.cleanup_functions:
+			cleanup()
+		del player, exp
+		gc.collect()
+		final = process_resources()
+		problems += _leak_problems(baseline, final, max_rss_growth)
+	finally:
+		shutil.rmtree(tmp_dir, True)
+	return {"baseline": baseline, "final": final, "cycles": cycles, "errors": errors, "problems": problems, "ok": not problems}
+
+
+#---------------------------------------------------------------------
+# Command line
+#---------------------------------------------------------------------
+
+def run_readahead_test():
+	"""
+	Runs readahead_test() and prints its report
+
+	Returns:
+	The exit status: 0 if the test passed and 1 otherwise
+	"""
+	report = readahead_test()
+	print u"Read-ahead buffering: %s" % ("OK" if report["ok"] else "FAILED")
+	for problem in report["problems"]:
+		print u"  " + problem
+	return 0 if report["ok"] else 1
+
+def run_soak(paths, cycles):
+	"""
+	Soak-tests the videos with a bare decoder and through the item with each of the SOAK_VARIANTS,
+	and prints the reports
+
+	Arguments:
+	paths -- the videos, directories or experiments to test the videos of
+	cycles -- the number of times each video is played in each soak test
+
+	Returns:
+	The exit status: 0 if no resources leaked and 1 otherwise
+	"""
+	ok = True
+	tmp_dir = tempfile.mkdtemp(prefix="media_player_gst_")
+	try:
+		for path in paths:
+			for name, video, error in find_videos(path, tmp_dir):
+				if not error is None:
+					print u"ERROR  %s: %s" % (name, error)
+					ok = False
+					continue
+				reports = [(u"decoder", soak_test(video, cycles))]
+				for decoding, buffering in SOAK_VARIANTS:
+					reports.append((u"item, %s, buffering: %s" % (decoding, buffering),
+						item_soak_test(video, cycles, decoding = decoding, buffering = buffering)))
+				for variant, report in reports:
+					print u"%s  %s (%s)" % ("OK" if report["ok"] else "LEAK", name, variant)
+					print u"  threads %(threads)s, open files %(fds)s, memory %(rss)s bytes after warm-up" % report["baseline"]
+					print u"  threads %(threads)s, open files %(fds)s, memory %(rss)s bytes at the end" % report["final"]
+					if report["errors"]:
+						print u"  %d of %d cycles failed" % (report["errors"], report["cycles"])
+					for problem in report["problems"]:
+						print u"  " + problem
+					ok = ok and report["ok"]
+	finally:
+		shutil.rmtree(tmp_dir, True)
+	return 0 if ok else 1
+
+def main(argv=None):
+	"""
+	The command line entry point. Run `python media_player_gst_diagnostics.py --help` for its usage.
+
+	Keyword arguments:
+	argv -- the command line arguments (default = sys.argv[1:])
+
+	Returns:
+	The exit status: 0 if all tests passed and 1 otherwise
+	"""
+	parser = argparse.ArgumentParser(description=u"Diagnostics for the media_player_gst plugin.")
+	parser.add_argument("paths", nargs="*", metavar="PATH",
+		help=u"a video, a directory with videos or an experiment (.osexp or .opensesame.tar.gz) to soak-test the videos of")
+	parser.add_argument("--soak", type=int, metavar="CYCLES",
+		help=u"play each video CYCLES times in a row and check that the number of threads, open files and memory use do not grow")
+	parser.add_argument("--readahead-test", action="store_true",
+		help=u"test read-ahead buffering with a throttled test video")
+	args = parser.parse_args(argv)
+
+	if args.readahead_test:
+		return run_readahead_test()
+	if not args.soak:
+		parser.error(u"choose --soak or --readahead-test")
+	if not args.paths:
+		parser.error(u"no videos, directories or experiments given")
+	return run_soak(args.paths, args.soak)
+
+
+if __name__ == "__main__":
+	sys.exit(main())